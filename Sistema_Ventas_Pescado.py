@@ -2,21 +2,66 @@
 # -*- coding: utf-8 -*-
 
 import os
+import argparse
+import asyncio
+import bisect
+import io
+import json
+import pathlib
 import sqlite3
 import datetime
 import sys
+import threading
+import time
+import unicodedata
+import uuid
+
+try:
+    import numpy as np
+except ImportError:
+    # Solo lo necesita el pronóstico de demanda
+    np = None
 
 DB_NAME = "ventas_pescado.db"
+DIARIO_PENDIENTE = "ventas_pendientes.diario"
+# Segundos que un registro espera una base bloqueada antes de ir al diario
+ESPERA_REGISTRO = 0.2
+# Pedidos pendientes que se listan a la vez en las pantallas de conversión
+PEDIDOS_POR_PANTALLA = 15
+# Registros que el menú muestra en "Ver historial"; el resto se exporta o se busca
+HISTORIAL_EN_PANTALLA = 50
+CARPETA_RESPALDOS = "respaldos"
+# Historia mínima (días completos) para pronosticar la demanda
+DIAS_MINIMOS_PRONOSTICO = 28
+DIAS_SEMANA = ("lunes", "martes", "miércoles", "jueves", "viernes", "sábado", "domingo")
+
+# En la zona una libra se toma como 500 gramos (ver README)
+GRAMOS_POR_LIBRA = 500
+ESPECIE_GENERAL = "general"
+PRECIO_LIBRA_INICIAL = 6000.0
+
+# Columnas de ventas que se copian en cada entrada del registro de cambios
+COLUMNAS_CAMBIOS = ("fecha_hora", "nombre_cliente", "cantidad_libras", "cantidad_gramos",
+                    "tipo", "total", "cantidad_peces", "uid", "origen", "especie", "precio_libra")
 
 def limpiar_pantalla():
     print("\033[H\033[J", end="")
 
+def conectar_lectura():
+    """Abre una conexión de solo lectura que ve una sola instantánea de la base; quien la abre la cierra."""
+    uri = pathlib.Path(DB_NAME).resolve().as_uri() + "?mode=ro"
+    conn = sqlite3.connect(uri, uri=True, isolation_level=None)
+    conn.execute("BEGIN")
+    return conn
+
 def inicializar_bd():
     """Crea la base de datos, la tabla y agrega la columna cantidad_peces si no existe."""
     conn = None
     try:
         conn = sqlite3.connect(DB_NAME)
         cursor = conn.cursor()
+        # WAL permite que los reportes lean mientras otros escriben
+        cursor.execute("PRAGMA journal_mode=WAL")
         # Crear tabla si no existe
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS ventas (
@@ -35,6 +80,90 @@ def inicializar_bd():
         except sqlite3.OperationalError:
             # La columna ya existe, ignorar
             pass
+        # Identidad de este puesto, usada como origen de sus registros
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS configuracion (
+                clave TEXT PRIMARY KEY,
+                valor TEXT NOT NULL
+            )
+        """)
+        cursor.execute("INSERT OR IGNORE INTO configuracion (clave, valor) VALUES ('origen', ?)",
+                       (f"puesto-{uuid.uuid4().hex[:8]}",))
+        # Clave global (uid) y puesto de origen de cada fila, para combinar bases
+        agregar_columna(cursor, "ventas", "uid TEXT")
+        agregar_columna(cursor, "ventas", "origen TEXT")
+        cursor.execute("""
+            UPDATE ventas
+            SET uid = lower(hex(randomblob(16))),
+                origen = COALESCE(origen, (SELECT valor FROM configuracion WHERE clave = 'origen'))
+            WHERE uid IS NULL
+        """)
+        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_ventas_uid ON ventas (uid)")
+        # Especie y precio por libra aplicado (NULL si el total se fijó a mano)
+        agregar_columna(cursor, "ventas", "especie TEXT")
+        agregar_columna(cursor, "ventas", "precio_libra REAL")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_ventas_fecha ON ventas (fecha_hora)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_ventas_pedidos ON ventas (fecha_hora) WHERE tipo = 'pedido'")
+        # Cabecera de los tickets de varias líneas (carrito)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS tickets (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                fecha_hora TEXT NOT NULL,
+                nombre_cliente TEXT,
+                tipo TEXT NOT NULL CHECK(tipo IN ('venta', 'pedido')),
+                total REAL NOT NULL,
+                lineas INTEGER NOT NULL,
+                uid TEXT UNIQUE
+            )
+        """)
+        agregar_columna(cursor, "ventas", "ticket_id INTEGER REFERENCES tickets (id)")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS precios (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                especie TEXT NOT NULL,
+                precio_libra REAL NOT NULL CHECK(precio_libra > 0),
+                vigente_desde TEXT NOT NULL
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_precios_especie ON precios (especie, vigente_desde)")
+        cursor.execute("""
+            INSERT INTO precios (especie, precio_libra, vigente_desde)
+            SELECT ?, ?, '0000-01-01 00:00:00'
+            WHERE NOT EXISTS (SELECT 1 FROM precios)
+        """, (ESPECIE_GENERAL, PRECIO_LIBRA_INICIAL))
+        # Último seq importado de cada puesto remoto
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS sincronizacion (
+                origen_remoto TEXT PRIMARY KEY,
+                ultimo_seq INTEGER NOT NULL,
+                actualizado TEXT NOT NULL
+            )
+        """)
+        # Claves de las operaciones ya aplicadas y su resultado (evita repetir
+        # las del diario y los reintentos de las terminales)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS operaciones (
+                clave TEXT PRIMARY KEY,
+                tipo TEXT NOT NULL,
+                fecha_hora TEXT NOT NULL
+            )
+        """)
+        agregar_columna(cursor, "operaciones", "resultado TEXT")
+        crear_registro_cambios(cursor)
+        crear_inventario(cursor)
+        crear_busqueda(cursor)
+        crear_cierres(cursor)
+        # Hallazgos del verificador de integridad
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS hallazgos (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                detectado TEXT NOT NULL,
+                regla TEXT NOT NULL,
+                venta_id INTEGER,
+                detalle TEXT NOT NULL
+            )
+        """)
+        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_hallazgos_regla_venta ON hallazgos (regla, venta_id)")
         conn.commit()
     except sqlite3.Error as e:
         print(f"Error al inicializar la base de datos: {e}")
@@ -43,6 +172,1075 @@ def inicializar_bd():
         if conn:
             conn.close()
 
+def agregar_columna(cursor, tabla, definicion):
+    """Agrega una columna a la tabla si todavía no existe."""
+    try:
+        cursor.execute(f"ALTER TABLE {tabla} ADD COLUMN {definicion}")
+    except sqlite3.OperationalError:
+        # La columna ya existe, ignorar
+        pass
+
+def crear_registro_cambios(cursor):
+    """Crea la tabla cambios y los triggers de ventas que anotan cada cambio con su seq."""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'cambios'")
+    tabla_nueva = cursor.fetchone() is None
+    columnas = ", ".join(COLUMNAS_CAMBIOS)
+    nuevas = ", ".join(f"NEW.{c}" for c in COLUMNAS_CAMBIOS)
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS cambios (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            venta_id INTEGER NOT NULL,
+            operacion TEXT NOT NULL,
+            registrado TEXT NOT NULL DEFAULT (datetime('now', 'localtime')),
+            {columnas}
+        )
+    """)
+    for columna in COLUMNAS_CAMBIOS:
+        # Bases creadas antes de que existiera la columna
+        agregar_columna(cursor, "cambios", columna)
+    cursor.execute("""
+        UPDATE cambios SET uid = (SELECT uid FROM ventas WHERE ventas.id = cambios.venta_id)
+        WHERE uid IS NULL
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_cambios_venta ON cambios (venta_id, seq)")
+    cursor.execute("DROP TRIGGER IF EXISTS cambios_insercion")
+    cursor.execute(f"""
+        CREATE TRIGGER cambios_insercion AFTER INSERT ON ventas
+        BEGIN
+            INSERT INTO cambios (venta_id, operacion, {columnas})
+            VALUES (NEW.id, 'insercion', {nuevas});
+        END
+    """)
+    cursor.execute("DROP TRIGGER IF EXISTS cambios_conversion")
+    cursor.execute(f"""
+        CREATE TRIGGER cambios_conversion AFTER UPDATE OF tipo ON ventas
+        WHEN OLD.tipo = 'pedido' AND NEW.tipo = 'venta'
+        BEGIN
+            INSERT INTO cambios (venta_id, operacion, {columnas})
+            VALUES (NEW.id,
+                    CASE WHEN OLD.cantidad_peces IS NULL THEN 'conversion' ELSE 'completado' END,
+                    {nuevas});
+        END
+    """)
+    # Cualquier otro cambio de columnas copiadas (recálculos, sincronizaciones)
+    cambio_real = " OR ".join(f"OLD.{c} IS NOT NEW.{c}" for c in COLUMNAS_CAMBIOS)
+    cursor.execute("DROP TRIGGER IF EXISTS cambios_actualizacion")
+    cursor.execute(f"""
+        CREATE TRIGGER cambios_actualizacion AFTER UPDATE OF {columnas} ON ventas
+        WHEN OLD.tipo = NEW.tipo AND ({cambio_real})
+        BEGIN
+            INSERT INTO cambios (venta_id, operacion, {columnas})
+            VALUES (NEW.id, 'actualizacion', {nuevas});
+        END
+    """)
+    if tabla_nueva:
+        # Las filas anteriores al registro entran como inserciones iniciales
+        cursor.execute(f"""
+            INSERT INTO cambios (venta_id, operacion, {columnas})
+            SELECT id, 'insercion', {columnas} FROM ventas ORDER BY id
+        """)
+
+def obtener_cambios(desde=0, tam_lote=500):
+    """Genera lotes con los cambios de seq mayor que desde, leídos de una sola instantánea."""
+    conn = conectar_lectura()
+    try:
+        cursor = conn.cursor()
+        ultimo = desde
+        while True:
+            cursor.execute(f"""
+                SELECT seq, venta_id, operacion, registrado, {", ".join(COLUMNAS_CAMBIOS)}
+                FROM cambios
+                WHERE seq > ?
+                ORDER BY seq
+                LIMIT ?
+            """, (ultimo, tam_lote))
+            filas = cursor.fetchall()
+            if not filas:
+                return
+            nombres = [d[0] for d in cursor.description]
+            yield [dict(zip(nombres, fila)) for fila in filas]
+            ultimo = filas[-1][0]
+    finally:
+        conn.close()
+
+def compactar_cambios(hasta_seq):
+    """Borra los cambios hasta hasta_seq ya superados por otro de la misma venta; devuelve cuántos."""
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_NAME)
+        cursor = conn.cursor()
+        cursor.execute("""
+            DELETE FROM cambios
+            WHERE seq <= ?
+              AND operacion NOT IN ('conversion', 'completado')
+              AND EXISTS (SELECT 1 FROM cambios AS posterior
+                          WHERE posterior.venta_id = cambios.venta_id
+                            AND posterior.seq > cambios.seq)
+        """, (hasta_seq,))
+        borradas = cursor.rowcount
+        conn.commit()
+        return borradas
+    finally:
+        if conn:
+            conn.close()
+
+_cache_precios = None
+_version_precios = None
+
+def invalidar_cache_precios():
+    global _cache_precios
+    _cache_precios = None
+
+def cargar_precios():
+    """Devuelve el historial de precios en memoria, recargándolo si otra terminal registró uno."""
+    global _cache_precios, _version_precios
+    conn = conectar_lectura()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT MAX(id) FROM precios")
+        version = cursor.fetchone()[0]
+        if _cache_precios is None or version != _version_precios:
+            cache = {}
+            cursor.execute("SELECT especie, vigente_desde, precio_libra FROM precios ORDER BY especie, vigente_desde, id")
+            for especie, vigente_desde, precio in cursor:
+                fechas, valores = cache.setdefault(especie, ([], []))
+                fechas.append(vigente_desde)
+                valores.append(precio)
+            _cache_precios, _version_precios = cache, version
+        return _cache_precios
+    finally:
+        conn.close()
+
+def precio_vigente(especie=None, fecha_hora=None):
+    """Precio por libra de la especie en la fecha dada (por defecto, ahora)."""
+    precios = cargar_precios()
+    fechas, valores = precios.get(especie or ESPECIE_GENERAL, precios.get(ESPECIE_GENERAL, ([], [])))
+    i = bisect.bisect_right(fechas, fecha_hora or fecha_hora_actual())
+    if i == 0:
+        return PRECIO_LIBRA_INICIAL
+    return valores[i - 1]
+
+def elegir_especie():
+    """Pide la especie solo si hay más de una con precio; si no, usa la general."""
+    especies = sorted(cargar_precios())
+    if len(especies) <= 1:
+        return especies[0] if especies else ESPECIE_GENERAL
+    print("Especies: " + ", ".join(especies))
+    while True:
+        especie = input(f"Especie (Enter para {ESPECIE_GENERAL}): ").strip().lower() or ESPECIE_GENERAL
+        if especie in especies:
+            return especie
+        print("Error: especie sin precio registrado.")
+
+def registrar_precio(especie, precio_libra, vigente_desde=None):
+    """Agrega un precio al historial y descarta el caché de precios."""
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_NAME)
+        conn.execute("INSERT INTO precios (especie, precio_libra, vigente_desde) VALUES (?, ?, ?)",
+                     (especie, precio_libra, vigente_desde or fecha_hora_actual()))
+        conn.commit()
+    finally:
+        if conn:
+            conn.close()
+    invalidar_cache_precios()
+
+def recalcular_totales(desde, hasta, especie=None):
+    """Recalcula con los precios vigentes los totales por libra entre dos fechas; devuelve cuántos cambiaron."""
+    filtro_especie = "AND COALESCE(v.especie, :general) = :especie" if especie else ""
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_NAME)
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            UPDATE ventas
+            SET precio_libra = nuevos.precio, total = ventas.cantidad_libras * nuevos.precio
+            FROM (
+                SELECT v.id,
+                       (SELECT p.precio_libra FROM precios AS p
+                        WHERE p.especie = COALESCE(v.especie, :general) AND p.vigente_desde <= v.fecha_hora
+                        ORDER BY p.vigente_desde DESC, p.id DESC LIMIT 1) AS precio
+                FROM ventas AS v
+                WHERE v.fecha_hora >= :desde AND v.fecha_hora < date(:hasta, '+1 day')
+                  AND v.precio_libra IS NOT NULL {filtro_especie}
+                  AND NOT EXISTS (SELECT 1 FROM cierres WHERE fecha = substr(v.fecha_hora, 1, 10))
+            ) AS nuevos
+            WHERE ventas.id = nuevos.id AND nuevos.precio IS NOT NULL AND nuevos.precio <> ventas.precio_libra
+        """, {"general": ESPECIE_GENERAL, "especie": especie, "desde": desde, "hasta": hasta})
+        cambiadas = cursor.rowcount
+        conn.commit()
+        if cambiadas:
+            # Los pedidos pendientes en memoria tienen los totales anteriores
+            invalidar_pedidos_pendientes()
+        return cambiadas
+    finally:
+        if conn:
+            conn.close()
+
+def obtener_fecha(mensaje):
+    """Solicita una fecha AAAA-MM-DD; devuelve None si se deja vacía."""
+    while True:
+        valor = input(mensaje).strip()
+        if not valor:
+            return None
+        try:
+            return datetime.datetime.strptime(valor, "%Y-%m-%d").strftime("%Y-%m-%d")
+        except ValueError:
+            print("Fecha inválida. Use el formato AAAA-MM-DD.")
+
+def ver_precios():
+    """Muestra el precio vigente de cada especie."""
+    print("\n--- Precios vigentes ---")
+    try:
+        precios = cargar_precios()
+    except sqlite3.Error as e:
+        print(f"Error al consultar la base de datos: {e}")
+        return
+    for especie in sorted(precios):
+        fechas, _ = precios[especie]
+        print(f"{especie}: ${precio_vigente(especie):,.2f} por libra (desde {fechas[-1]})")
+
+def cambiar_precio():
+    """Registra un nuevo precio por libra para una especie."""
+    print("\n--- Registrar precio ---")
+    especie = input(f"Especie (Enter para {ESPECIE_GENERAL}): ").strip().lower() or ESPECIE_GENERAL
+    precio = obtener_flotante_positivo("Precio por libra (COP): ")
+    desde = obtener_fecha("Vigente desde (AAAA-MM-DD, Enter para ahora): ")
+    vigente_desde = f"{desde} 00:00:00" if desde else None
+    try:
+        registrar_precio(especie, precio, vigente_desde)
+    except sqlite3.Error as e:
+        print(f"Error al guardar en la base de datos: {e}")
+        return
+    print(f"Precio de {especie} registrado: ${precio:,.2f} por libra.")
+
+def recalcular_totales_rango():
+    """Opción de menú para recalcular los totales de un rango de fechas."""
+    print("\n--- Recalcular totales ---")
+    desde = None
+    while not desde:
+        desde = obtener_fecha("Desde (AAAA-MM-DD): ")
+    hasta = None
+    while not hasta:
+        hasta = obtener_fecha("Hasta (AAAA-MM-DD): ")
+    especie = input("Especie (Enter para todas): ").strip().lower() or None
+    confirmar = input("¿Recalcular los totales cobrados por libra en ese rango? (s/n): ").strip().lower()
+    if confirmar != "s":
+        print("Operación cancelada.")
+        return
+    try:
+        cambiadas = recalcular_totales(desde, hasta, especie)
+    except sqlite3.Error as e:
+        print(f"Error en la base de datos: {e}")
+        return
+    print(f"Se recalcularon {cambiadas} registros (los días ya cerrados no se tocan).")
+
+def menu_precios():
+    while True:
+        print("\n--- Precios ---")
+        print("1. Ver precios vigentes")
+        print("2. Registrar precio")
+        print("3. Recalcular totales de un rango de fechas")
+        print("4. Volver")
+        opcion = input("\nSeleccione una opción (1-4): ").strip()
+        if opcion == "1":
+            ver_precios()
+        elif opcion == "2":
+            cambiar_precio()
+        elif opcion == "3":
+            recalcular_totales_rango()
+        elif opcion == "4":
+            return
+        else:
+            print("Opción no válida.")
+
+def crear_inventario(cursor):
+    """Crea las tablas del inventario y los triggers que llevan su libro de movimientos y su saldo."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS inventario_entradas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            fecha_hora TEXT NOT NULL,
+            gramos REAL NOT NULL DEFAULT 0,
+            peces INTEGER NOT NULL DEFAULT 0,
+            proveedor TEXT
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS reservas (
+            venta_id INTEGER PRIMARY KEY,
+            fecha_hora TEXT NOT NULL,
+            gramos REAL NOT NULL,
+            peces INTEGER NOT NULL,
+            estado TEXT NOT NULL CHECK(estado IN ('activa', 'consumida', 'liberada'))
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS inventario_movimientos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            fecha_hora TEXT NOT NULL,
+            movimiento TEXT NOT NULL,
+            referencia INTEGER,
+            gramos_disponibles REAL NOT NULL DEFAULT 0,
+            peces_disponibles INTEGER NOT NULL DEFAULT 0,
+            gramos_reservados REAL NOT NULL DEFAULT 0,
+            peces_reservados INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_inventario_movimientos_fecha ON inventario_movimientos (fecha_hora)")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS inventario_saldo (
+            id INTEGER PRIMARY KEY CHECK(id = 1),
+            gramos_disponibles REAL NOT NULL,
+            peces_disponibles INTEGER NOT NULL,
+            gramos_reservados REAL NOT NULL,
+            peces_reservados INTEGER NOT NULL
+        )
+    """)
+    cursor.execute("INSERT OR IGNORE INTO inventario_saldo VALUES (1, 0, 0, 0, 0)")
+    saldo_nuevo = cursor.rowcount == 1
+
+    triggers = {
+        "inventario_saldo_movimiento": """
+            AFTER INSERT ON inventario_movimientos
+            BEGIN
+                UPDATE inventario_saldo
+                SET gramos_disponibles = gramos_disponibles + NEW.gramos_disponibles,
+                    peces_disponibles = peces_disponibles + NEW.peces_disponibles,
+                    gramos_reservados = gramos_reservados + NEW.gramos_reservados,
+                    peces_reservados = peces_reservados + NEW.peces_reservados
+                WHERE id = 1;
+            END""",
+        "inventario_entrada": """
+            AFTER INSERT ON inventario_entradas
+            BEGIN
+                INSERT INTO inventario_movimientos (fecha_hora, movimiento, referencia, gramos_disponibles, peces_disponibles)
+                VALUES (NEW.fecha_hora, 'entrada', NEW.id, NEW.gramos, NEW.peces);
+            END""",
+        "inventario_reserva": """
+            AFTER INSERT ON reservas
+            BEGIN
+                INSERT INTO inventario_movimientos (fecha_hora, movimiento, referencia, gramos_reservados, peces_reservados)
+                VALUES (NEW.fecha_hora, 'reserva', NEW.venta_id, NEW.gramos, NEW.peces);
+            END""",
+        "inventario_fin_reserva": """
+            AFTER UPDATE OF estado ON reservas
+            WHEN OLD.estado = 'activa' AND NEW.estado <> 'activa'
+            BEGIN
+                INSERT INTO inventario_movimientos (fecha_hora, movimiento, referencia, gramos_reservados, peces_reservados)
+                VALUES (datetime('now', 'localtime'), NEW.estado, NEW.venta_id, -OLD.gramos, -OLD.peces);
+            END""",
+        "inventario_venta_directa": """
+            AFTER INSERT ON ventas
+            WHEN NEW.tipo = 'venta' AND NEW.origen = (SELECT valor FROM configuracion WHERE clave = 'origen')
+            BEGIN
+                INSERT INTO inventario_movimientos (fecha_hora, movimiento, referencia, gramos_disponibles, peces_disponibles)
+                VALUES (NEW.fecha_hora, 'venta', NEW.id, -NEW.cantidad_gramos, -COALESCE(NEW.cantidad_peces, 0));
+            END""",
+        "inventario_pedido": """
+            AFTER INSERT ON ventas
+            WHEN NEW.tipo = 'pedido' AND NEW.origen = (SELECT valor FROM configuracion WHERE clave = 'origen')
+            BEGIN
+                INSERT INTO reservas (venta_id, fecha_hora, gramos, peces, estado)
+                VALUES (NEW.id, NEW.fecha_hora, NEW.cantidad_gramos, COALESCE(NEW.cantidad_peces, 0), 'activa');
+            END""",
+        "inventario_pedido_vendido": """
+            AFTER UPDATE OF tipo ON ventas
+            WHEN OLD.tipo = 'pedido' AND NEW.tipo = 'venta' AND NEW.origen = (SELECT valor FROM configuracion WHERE clave = 'origen')
+            BEGIN
+                UPDATE reservas SET estado = 'consumida' WHERE venta_id = NEW.id AND estado = 'activa';
+                INSERT INTO inventario_movimientos (fecha_hora, movimiento, referencia, gramos_disponibles, peces_disponibles)
+                VALUES (datetime('now', 'localtime'), 'venta', NEW.id,
+                        -NEW.cantidad_gramos, -COALESCE(NEW.cantidad_peces, 0));
+            END""",
+        "inventario_pedido_borrado": """
+            AFTER DELETE ON ventas
+            WHEN OLD.tipo = 'pedido'
+            BEGIN
+                UPDATE reservas SET estado = 'liberada' WHERE venta_id = OLD.id AND estado = 'activa';
+            END""",
+    }
+    for nombre, cuerpo in triggers.items():
+        cursor.execute(f"DROP TRIGGER IF EXISTS {nombre}")
+        cursor.execute(f"CREATE TRIGGER {nombre} {cuerpo}")
+
+    if saldo_nuevo:
+        # Los pedidos que ya estaban pendientes quedan reservados desde el inicio
+        cursor.execute("""
+            INSERT OR IGNORE INTO reservas (venta_id, fecha_hora, gramos, peces, estado)
+            SELECT id, fecha_hora, cantidad_gramos, COALESCE(cantidad_peces, 0), 'activa'
+            FROM ventas
+            WHERE tipo = 'pedido' AND origen = (SELECT valor FROM configuracion WHERE clave = 'origen')
+        """)
+
+def consultar_stock(cursor):
+    """Devuelve (gramos_libres, peces_libres, hay_inventario) leyendo solo el saldo."""
+    cursor.execute("""
+        SELECT gramos_disponibles - gramos_reservados, peces_disponibles - peces_reservados,
+               EXISTS (SELECT 1 FROM inventario_entradas)
+        FROM inventario_saldo WHERE id = 1
+    """)
+    gramos, peces, hay_inventario = cursor.fetchone()
+    return gramos, peces, bool(hay_inventario)
+
+def avisar_si_falta_stock(gramos=0.0, peces=0):
+    """Muestra un aviso si la operación supera el stock libre (si se lleva inventario)."""
+    conn = None
+    try:
+        conn = conectar_lectura()
+        gramos_libres, peces_libres, hay_inventario = consultar_stock(conn.cursor())
+    except sqlite3.Error:
+        # Sin acceso a la base no se puede avisar; el registro sigue su curso
+        return
+    finally:
+        if conn:
+            conn.close()
+    if not hay_inventario:
+        return
+    if gramos > gramos_libres:
+        print(f"Aviso: stock insuficiente, quedan {max(gramos_libres, 0):.2f} gramos libres.")
+    if peces > peces_libres:
+        print(f"Aviso: stock insuficiente, quedan {max(peces_libres, 0)} peces libres.")
+
+def registrar_entrada_inventario():
+    """Registra una entrega del proveedor en gramos y/o cantidad de peces."""
+    print("\n--- Registrar entrada de pescado ---")
+    modalidad = ""
+    while modalidad not in ("l", "g", "p"):
+        modalidad = input("¿Registrar peso en libras, en gramos o solo peces? (l/g/p): ").strip().lower()
+        if modalidad not in ("l", "g", "p"):
+            print("Error: ingrese 'l' para libras, 'g' para gramos o 'p' para peces.")
+    gramos = 0.0
+    if modalidad == "l":
+        gramos = obtener_flotante_positivo("Cantidad en libras: ") * GRAMOS_POR_LIBRA
+    elif modalidad == "g":
+        gramos = obtener_flotante_positivo("Cantidad en gramos: ")
+    if modalidad == "p":
+        peces = obtener_entero_positivo("Cantidad de peces: ")
+    else:
+        texto = input("Cantidad de peces (Enter si no se contaron): ").strip()
+        peces = int(texto) if texto.isdigit() else 0
+    proveedor = input("Proveedor (opcional): ").strip() or None
+
+    print(f"\nEntrada: {gramos:.2f} gramos, {peces} peces")
+    confirmar = input("¿Guardar? (s/n): ").strip().lower()
+    if confirmar != "s":
+        print("Operación cancelada.")
+        return
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_NAME)
+        conn.execute("""
+            INSERT INTO inventario_entradas (fecha_hora, gramos, peces, proveedor) VALUES (?, ?, ?, ?)
+        """, (fecha_hora_actual(), gramos, peces, proveedor))
+        conn.commit()
+        print("Entrada registrada correctamente.")
+    except sqlite3.Error as e:
+        print(f"Error al guardar en la base de datos: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+def ver_stock():
+    """Muestra el saldo actual del inventario."""
+    print("\n--- Stock actual ---")
+    conn = None
+    try:
+        conn = conectar_lectura()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT gramos_disponibles, peces_disponibles, gramos_reservados, peces_reservados
+            FROM inventario_saldo WHERE id = 1
+        """)
+        gramos_disp, peces_disp, gramos_res, peces_res = cursor.fetchone()
+        print(f"En existencia: {gramos_disp:,.2f} gramos ({gramos_disp / GRAMOS_POR_LIBRA:,.2f} libras), {peces_disp} peces")
+        print(f"Reservado:     {gramos_res:,.2f} gramos ({gramos_res / GRAMOS_POR_LIBRA:,.2f} libras), {peces_res} peces")
+        print(f"Libre:         {gramos_disp - gramos_res:,.2f} gramos, {peces_disp - peces_res} peces")
+    except sqlite3.Error as e:
+        print(f"Error al consultar la base de datos: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+def reporte_inventario_diario(dias=14):
+    """Muestra por día las entradas, ventas, reservas y el saldo al cierre de los últimos días."""
+    print("\n--- Reporte diario de inventario ---")
+    conn = None
+    try:
+        conn = conectar_lectura()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT dia, entradas, vendidos, reservados,
+                   s.gramos_disponibles - COALESCE(SUM(neto_disponible) OVER posteriores, 0) AS existencia,
+                   s.gramos_reservados - COALESCE(SUM(neto_reservado) OVER posteriores, 0) AS reserva
+            FROM inventario_saldo AS s, (
+                SELECT date(fecha_hora) AS dia,
+                       SUM(CASE WHEN movimiento = 'entrada' THEN gramos_disponibles ELSE 0 END) AS entradas,
+                       -SUM(CASE WHEN movimiento = 'venta' THEN gramos_disponibles ELSE 0 END) AS vendidos,
+                       SUM(CASE WHEN movimiento = 'reserva' THEN gramos_reservados ELSE 0 END) AS reservados,
+                       SUM(gramos_disponibles) AS neto_disponible,
+                       SUM(gramos_reservados) AS neto_reservado
+                FROM inventario_movimientos
+                WHERE fecha_hora >= date('now', 'localtime', ?)
+                GROUP BY dia
+            )
+            WHERE s.id = 1
+            WINDOW posteriores AS (ORDER BY dia DESC ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING)
+            ORDER BY dia DESC
+        """, (f"-{dias - 1} days",))
+        filas = cursor.fetchall()
+        if not filas:
+            print("No hay movimientos de inventario.")
+            return
+        print(f"{'Fecha':<12}{'Entradas g':>14}{'Vendidos g':>14}{'Reservados g':>14}{'Existencia g':>14}{'Reserva g':>14}")
+        print("-" * 82)
+        for dia, entradas, vendidos, reservados, existencia, reserva in filas:
+            print(f"{dia:<12}{entradas:>14,.2f}{vendidos:>14,.2f}{reservados:>14,.2f}{existencia:>14,.2f}{reserva:>14,.2f}")
+    except sqlite3.Error as e:
+        print(f"Error al consultar la base de datos: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+def liberar_reserva_pedido():
+    """Libera el pescado apartado por un pedido abandonado; el pedido sigue en el historial."""
+    print("\n--- Liberar reserva de un pedido ---")
+    conn = None
+    try:
+        conn = conectar_lectura()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT r.venta_id, r.fecha_hora, v.nombre_cliente, r.gramos, r.peces
+            FROM reservas AS r JOIN ventas AS v ON v.id = r.venta_id
+            WHERE r.estado = 'activa'
+            ORDER BY r.fecha_hora
+            LIMIT ?
+        """, (PEDIDOS_POR_PANTALLA,))
+        reservas = cursor.fetchall()
+    except sqlite3.Error as e:
+        print(f"Error al consultar la base de datos: {e}")
+        return
+    finally:
+        if conn:
+            conn.close()
+    if not reservas:
+        print("No hay reservas activas.")
+        return
+    print("Reservas activas más antiguas:")
+    for venta_id, fecha, nombre, gramos, peces in reservas:
+        print(f"Pedido ID: {venta_id} | Fecha: {fecha} | Cliente: {nombre or '(sin nombre)'}"
+              f" | {gramos:,.2f} gramos | {peces} peces")
+    id_pedido = obtener_entero_positivo("\nID del pedido cuya reserva se libera: ")
+    confirmar = input("El pescado volverá a quedar libre. ¿Confirmar? (s/n): ").strip().lower()
+    if confirmar != "s":
+        print("Operación cancelada.")
+        return
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_NAME)
+        cursor = conn.cursor()
+        cursor.execute("UPDATE reservas SET estado = 'liberada' WHERE venta_id = ? AND estado = 'activa'",
+                       (id_pedido,))
+        conn.commit()
+        if cursor.rowcount:
+            print(f"Reserva del pedido ID {id_pedido} liberada.")
+        else:
+            print(f"El pedido ID {id_pedido} no tiene una reserva activa.")
+    except sqlite3.Error as e:
+        print(f"Error en la base de datos: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+def menu_inventario():
+    while True:
+        print("\n--- Inventario ---")
+        print("1. Registrar entrada de pescado")
+        print("2. Ver stock actual")
+        print("3. Reporte diario")
+        print("4. Liberar reserva de un pedido abandonado")
+        print("5. Volver")
+        opcion = input("\nSeleccione una opción (1-5): ").strip()
+        if opcion == "1":
+            registrar_entrada_inventario()
+        elif opcion == "2":
+            ver_stock()
+        elif opcion == "3":
+            reporte_inventario_diario()
+        elif opcion == "4":
+            liberar_reserva_pedido()
+        elif opcion == "5":
+            return
+        else:
+            print("Opción no válida.")
+
+def crear_cierres(cursor):
+    """Crea las tablas del cierre de caja y los triggers que anotan los ajustes posteriores."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS cierres (
+            fecha TEXT PRIMARY KEY,
+            cerrado_en TEXT NOT NULL,
+            ventas_cantidad INTEGER NOT NULL,
+            ventas_libras REAL NOT NULL,
+            ventas_total REAL NOT NULL,
+            pedidos_cantidad INTEGER NOT NULL,
+            pedidos_total REAL NOT NULL,
+            conversiones_cantidad INTEGER NOT NULL,
+            conversiones_total REAL NOT NULL,
+            pedidos_peces_pendientes INTEGER NOT NULL,
+            peces_pendientes INTEGER NOT NULL,
+            total_cobrado REAL NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ajustes_cierre (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            fecha TEXT NOT NULL REFERENCES cierres (fecha),
+            venta_id INTEGER NOT NULL,
+            operacion TEXT NOT NULL,
+            tipo TEXT NOT NULL,
+            diferencia_total REAL NOT NULL,
+            registrado TEXT NOT NULL DEFAULT (datetime('now', 'localtime'))
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ajustes_cierre_fecha ON ajustes_cierre (fecha)")
+    # Las conversiones de cada día se buscan por fecha de registro
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_cambios_conversiones ON cambios (registrado)
+        WHERE operacion IN ('conversion', 'completado')
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS cierres_inmutables_actualizacion BEFORE UPDATE ON cierres
+        BEGIN
+            SELECT RAISE(ABORT, 'Un cierre de caja no se puede modificar');
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS cierres_inmutables_borrado BEFORE DELETE ON cierres
+        BEGIN
+            SELECT RAISE(ABORT, 'Un cierre de caja no se puede borrar');
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS ajuste_cierre_insercion AFTER INSERT ON ventas
+        WHEN EXISTS (SELECT 1 FROM cierres WHERE fecha = substr(NEW.fecha_hora, 1, 10))
+        BEGIN
+            INSERT INTO ajustes_cierre (fecha, venta_id, operacion, tipo, diferencia_total)
+            VALUES (substr(NEW.fecha_hora, 1, 10), NEW.id, 'insercion', NEW.tipo, NEW.total);
+        END
+    """)
+    # Convertir o completar un pedido entra en el cierre del día en que se hace,
+    # como conversión; si ese día ya está cerrado, queda como ajuste de ese día
+    # (se haya movido o no la fecha del pedido)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS ajuste_cierre_conversion AFTER UPDATE OF tipo ON ventas
+        WHEN OLD.tipo = 'pedido' AND NEW.tipo = 'venta'
+         AND EXISTS (SELECT 1 FROM cierres WHERE fecha = date('now', 'localtime'))
+        BEGIN
+            INSERT INTO ajustes_cierre (fecha, venta_id, operacion, tipo, diferencia_total)
+            VALUES (date('now', 'localtime'), NEW.id,
+                    CASE WHEN OLD.cantidad_peces IS NULL THEN 'conversion' ELSE 'completado' END,
+                    NEW.tipo, NEW.total);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS ajuste_cierre_actualizacion AFTER UPDATE OF total ON ventas
+        WHEN OLD.tipo = NEW.tipo AND OLD.total <> NEW.total
+         AND EXISTS (SELECT 1 FROM cierres WHERE fecha = substr(OLD.fecha_hora, 1, 10))
+        BEGIN
+            INSERT INTO ajustes_cierre (fecha, venta_id, operacion, tipo, diferencia_total)
+            VALUES (substr(OLD.fecha_hora, 1, 10), NEW.id, 'actualizacion', NEW.tipo, NEW.total - OLD.total);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS ajuste_cierre_borrado AFTER DELETE ON ventas
+        WHEN EXISTS (SELECT 1 FROM cierres WHERE fecha = substr(OLD.fecha_hora, 1, 10))
+        BEGIN
+            INSERT INTO ajustes_cierre (fecha, venta_id, operacion, tipo, diferencia_total)
+            VALUES (substr(OLD.fecha_hora, 1, 10), OLD.id, 'borrado', OLD.tipo, -OLD.total);
+        END
+    """)
+
+# Una fila con fecha del día era pedido al cierre si sigue siéndolo o si se
+# convirtió después; así un cierre atrasado da las mismas cifras que a tiempo.
+_ERA_PEDIDO_AL_CIERRE = """(v.tipo = 'pedido' OR EXISTS (
+    SELECT 1 FROM cambios AS c
+    WHERE c.venta_id = v.id AND c.operacion IN ('conversion', 'completado') AND c.registrado >= :fin))"""
+
+def cerrar_caja(fecha=None):
+    """Calcula y guarda el cierre de un día (por defecto hoy); devuelve el cierre o None si ya existía."""
+    fecha = fecha or datetime.date.today().isoformat()
+    if fecha > datetime.date.today().isoformat():
+        raise ValueError("No se puede cerrar un día que todavía no llega.")
+    fin = (datetime.date.fromisoformat(fecha) + datetime.timedelta(days=1)).isoformat()
+    parametros = {"inicio": fecha, "fin": fin}
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_NAME)
+        cursor = conn.cursor()
+        # Escritura desde el principio: nada se registra entre el cálculo y la fila de cierre
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("SELECT 1 FROM cierres WHERE fecha = ?", (fecha,))
+        if cursor.fetchone():
+            conn.rollback()
+            return None
+        cursor.execute(f"""
+            SELECT COALESCE(SUM(NOT {_ERA_PEDIDO_AL_CIERRE}), 0),
+                   COALESCE(SUM(CASE WHEN {_ERA_PEDIDO_AL_CIERRE} THEN 0 ELSE v.cantidad_libras END), 0),
+                   COALESCE(SUM(CASE WHEN {_ERA_PEDIDO_AL_CIERRE} THEN 0 ELSE v.total END), 0),
+                   COALESCE(SUM({_ERA_PEDIDO_AL_CIERRE}), 0),
+                   COALESCE(SUM(CASE WHEN {_ERA_PEDIDO_AL_CIERRE} THEN v.total ELSE 0 END), 0)
+            FROM ventas AS v
+            WHERE v.fecha_hora >= :inicio AND v.fecha_hora < :fin
+        """, parametros)
+        ventas_cantidad, ventas_libras, ventas_total, pedidos_cantidad, pedidos_total = cursor.fetchone()
+        cursor.execute("""
+            SELECT COUNT(*), COALESCE(SUM(total), 0)
+            FROM cambios
+            WHERE operacion IN ('conversion', 'completado')
+              AND registrado >= :inicio AND registrado < :fin AND fecha_hora < :inicio
+        """, parametros)
+        conversiones_cantidad, conversiones_total = cursor.fetchone()
+        cursor.execute(f"""
+            SELECT COUNT(*), COALESCE(SUM(v.cantidad_peces), 0)
+            FROM ventas AS v
+            WHERE v.cantidad_peces IS NOT NULL AND v.fecha_hora < :fin AND {_ERA_PEDIDO_AL_CIERRE}
+        """, parametros)
+        pedidos_peces_pendientes, peces_pendientes = cursor.fetchone()
+        cierre = {
+            "fecha": fecha, "cerrado_en": fecha_hora_actual(),
+            "ventas_cantidad": ventas_cantidad, "ventas_libras": ventas_libras, "ventas_total": ventas_total,
+            "pedidos_cantidad": pedidos_cantidad, "pedidos_total": pedidos_total,
+            "conversiones_cantidad": conversiones_cantidad, "conversiones_total": conversiones_total,
+            "pedidos_peces_pendientes": pedidos_peces_pendientes, "peces_pendientes": peces_pendientes,
+            "total_cobrado": ventas_total + conversiones_total,
+        }
+        cursor.execute(f"""
+            INSERT INTO cierres ({", ".join(cierre)})
+            VALUES ({", ".join(":" + clave for clave in cierre)})
+        """, cierre)
+        conn.commit()
+        return cierre
+    finally:
+        if conn:
+            conn.close()
+
+def dias_sin_cierre():
+    """Devuelve las fechas anteriores a hoy con movimientos y sin cierre, en orden."""
+    conn = None
+    try:
+        conn = conectar_lectura()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT dia FROM (
+                SELECT DISTINCT substr(fecha_hora, 1, 10) AS dia FROM ventas
+                UNION
+                SELECT substr(registrado, 1, 10) FROM cambios WHERE operacion IN ('conversion', 'completado')
+            )
+            WHERE dia < date('now', 'localtime') AND dia NOT IN (SELECT fecha FROM cierres)
+            ORDER BY dia
+        """)
+        return [dia for (dia,) in cursor.fetchall()]
+    finally:
+        if conn:
+            conn.close()
+
+def _mostrar_cierre(cierre, ajustes=(0, 0.0)):
+    print(f"Cierre del {cierre['fecha']} (hecho el {cierre['cerrado_en']})")
+    print(f"  Ventas:       {cierre['ventas_cantidad']:>6} | {cierre['ventas_libras']:,.2f} lb | ${cierre['ventas_total']:,.2f}")
+    print(f"  Conversiones: {cierre['conversiones_cantidad']:>6} | pedidos de días anteriores | ${cierre['conversiones_total']:,.2f}")
+    print(f"  Pedidos:      {cierre['pedidos_cantidad']:>6} | pendientes al cierre | ${cierre['pedidos_total']:,.2f}")
+    print(f"  Pedidos por peces que pasan al día siguiente: {cierre['pedidos_peces_pendientes']}"
+          f" ({cierre['peces_pendientes']} peces)")
+    print(f"  Total cobrado: ${cierre['total_cobrado']:,.2f}")
+    cantidad, diferencia = ajustes
+    if cantidad:
+        print(f"  ¡Atención! {cantidad} cambios posteriores al cierre, diferencia de {diferencia:+,.2f} COP")
+
+def cerrar_caja_del_dia(fecha=None):
+    """Opción de menú: cierra hoy o el día indicado y muestra el resultado."""
+    try:
+        cierre = cerrar_caja(fecha)
+    except ValueError as e:
+        print(e)
+        return
+    except sqlite3.Error as e:
+        print(f"Error en la base de datos: {e}")
+        return
+    if cierre is None:
+        print(f"El día {fecha or datetime.date.today().isoformat()} ya está cerrado.")
+        return
+    _mostrar_cierre(cierre)
+
+def cerrar_dias_pendientes(progreso=None):
+    """Cierra en orden los días anteriores a hoy que tienen movimientos y no tienen cierre."""
+    try:
+        dias = dias_sin_cierre()
+        for n, dia in enumerate(dias, start=1):
+            cerrar_caja(dia)
+            if progreso is not None:
+                progreso(n / len(dias))
+    except sqlite3.Error as e:
+        print(f"Error en la base de datos: {e}")
+        return
+    print(f"Se cerraron {len(dias)} días pendientes.")
+
+def ver_cierre():
+    print("\n--- Ver cierre ---")
+    fecha = obtener_fecha("Fecha (AAAA-MM-DD, Enter para hoy): ") or datetime.date.today().isoformat()
+    conn = None
+    try:
+        conn = conectar_lectura()
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM cierres WHERE fecha = ?", (fecha,))
+        cierre = cursor.fetchone()
+        if cierre is None:
+            print(f"El día {fecha} no tiene cierre.")
+            return
+        cursor.execute("SELECT COUNT(*), COALESCE(SUM(diferencia_total), 0) FROM ajustes_cierre WHERE fecha = ?",
+                       (fecha,))
+        _mostrar_cierre(cierre, tuple(cursor.fetchone()))
+    except sqlite3.Error as e:
+        print(f"Error al consultar la base de datos: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+def reporte_cierres(largo_periodo=7):
+    """Suma los cierres y sus ajustes por mes (largo_periodo=7) o por año (4)."""
+    titulo = "mensual" if largo_periodo == 7 else "anual"
+    print(f"\n--- Reporte {titulo} de cierres ---")
+    conn = None
+    try:
+        conn = conectar_lectura()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT c.periodo, c.dias, c.ventas, c.conversiones, c.cobrado, c.pedidos,
+                   COALESCE(a.cantidad, 0), COALESCE(a.diferencia, 0)
+            FROM (
+                SELECT substr(fecha, 1, :largo) AS periodo, COUNT(*) AS dias, SUM(ventas_total) AS ventas,
+                       SUM(conversiones_total) AS conversiones, SUM(total_cobrado) AS cobrado,
+                       SUM(pedidos_total) AS pedidos
+                FROM cierres
+                GROUP BY periodo
+            ) AS c
+            LEFT JOIN (
+                SELECT substr(fecha, 1, :largo) AS periodo, COUNT(*) AS cantidad, SUM(diferencia_total) AS diferencia
+                FROM ajustes_cierre
+                GROUP BY periodo
+            ) AS a ON a.periodo = c.periodo
+            ORDER BY c.periodo DESC
+        """, {"largo": largo_periodo})
+        filas = cursor.fetchall()
+        if not filas:
+            print("No hay cierres de caja registrados.")
+            return
+        print(f"{'Periodo':<9}{'Días':>6}{'Ventas':>16}{'Conversiones':>16}{'Cobrado':>16}{'Pedidos':>16}{'Ajustes':>18}")
+        print("-" * 97)
+        for periodo, dias, ventas, conversiones, cobrado, pedidos, ajustes, diferencia in filas:
+            marca = f"{ajustes} ({diferencia:+,.0f})" if ajustes else "-"
+            print(f"{periodo:<9}{dias:>6}{ventas:>16,.2f}{conversiones:>16,.2f}{cobrado:>16,.2f}{pedidos:>16,.2f}{marca:>18}")
+    except sqlite3.Error as e:
+        print(f"Error al consultar la base de datos: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+def menu_cierres():
+    while True:
+        print("\n--- Cierre de caja ---")
+        print("1. Cerrar la caja de hoy")
+        print("2. Cerrar otro día")
+        print("3. Cerrar los días pendientes")
+        print("4. Ver el cierre de un día")
+        print("5. Reporte mensual")
+        print("6. Reporte anual")
+        print("7. Volver")
+        opcion = input("\nSeleccione una opción (1-7): ").strip()
+        if opcion == "1":
+            confirmar = input("Lo que se registre hoy después del cierre quedará como ajuste. ¿Cerrar? (s/n): ")
+            if confirmar.strip().lower() == "s":
+                cerrar_caja_del_dia()
+        elif opcion == "2":
+            fecha = obtener_fecha("Fecha a cerrar (AAAA-MM-DD): ")
+            if fecha:
+                cerrar_caja_del_dia(fecha)
+        elif opcion == "3":
+            lanzar_trabajo("Cerrar días pendientes", cerrar_dias_pendientes)
+        elif opcion == "4":
+            ver_cierre()
+        elif opcion == "5":
+            reporte_cierres(7)
+        elif opcion == "6":
+            reporte_cierres(4)
+        elif opcion == "7":
+            return
+        else:
+            print("Opción no válida.")
+
+def crear_busqueda(cursor):
+    """Crea el índice de texto completo de clientes, si hay FTS5, y los índices de los filtros."""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ventas_tipo_fecha ON ventas (tipo, fecha_hora)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ventas_total ON ventas (total)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ventas_peces ON ventas (cantidad_peces) WHERE cantidad_peces IS NOT NULL")
+
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'ventas_fts'")
+    tabla_nueva = cursor.fetchone() is None
+    try:
+        cursor.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS ventas_fts USING fts5(
+                nombre_cliente, content = 'ventas', content_rowid = 'id',
+                tokenize = 'unicode61 remove_diacritics 2'
+            )
+        """)
+    except sqlite3.OperationalError:
+        # SQLite compilado sin FTS5
+        return
+    triggers = {
+        "ventas_fts_insercion": """
+            AFTER INSERT ON ventas
+            BEGIN
+                INSERT INTO ventas_fts (rowid, nombre_cliente) VALUES (NEW.id, NEW.nombre_cliente);
+            END""",
+        "ventas_fts_borrado": """
+            AFTER DELETE ON ventas
+            BEGIN
+                INSERT INTO ventas_fts (ventas_fts, rowid, nombre_cliente) VALUES ('delete', OLD.id, OLD.nombre_cliente);
+            END""",
+        "ventas_fts_actualizacion": """
+            AFTER UPDATE OF nombre_cliente ON ventas
+            BEGIN
+                INSERT INTO ventas_fts (ventas_fts, rowid, nombre_cliente) VALUES ('delete', OLD.id, OLD.nombre_cliente);
+                INSERT INTO ventas_fts (rowid, nombre_cliente) VALUES (NEW.id, NEW.nombre_cliente);
+            END""",
+    }
+    for nombre, cuerpo in triggers.items():
+        cursor.execute(f"DROP TRIGGER IF EXISTS {nombre}")
+        cursor.execute(f"CREATE TRIGGER {nombre} {cuerpo}")
+    if tabla_nueva:
+        cursor.execute("INSERT INTO ventas_fts (ventas_fts) VALUES ('rebuild')")
+
+def _fusionar_entrantes(cursor):
+    """Aplica en ventas la última versión de cada uid de temp.entrantes; devuelve las filas cambiadas."""
+    columnas = ", ".join(COLUMNAS_CAMBIOS)
+    actualizar = ", ".join(f"{c} = excluded.{c}" for c in COLUMNAS_CAMBIOS if c != "uid")
+    distinta = " OR ".join(f"excluded.{c} IS NOT ventas.{c}" for c in COLUMNAS_CAMBIOS if c != "uid")
+    cursor.execute(f"""
+        INSERT INTO ventas ({columnas})
+        SELECT {columnas} FROM (
+            SELECT {columnas}, ROW_NUMBER() OVER (PARTITION BY uid ORDER BY orden DESC) AS puesto
+            FROM temp.entrantes
+            WHERE uid IS NOT NULL
+        )
+        WHERE puesto = 1
+        ON CONFLICT (uid) DO UPDATE SET {actualizar}
+        WHERE NOT (ventas.tipo = 'venta' AND excluded.tipo = 'pedido') AND ({distinta})
+    """)
+    return cursor.rowcount
+
+def _crear_tabla_entrantes(cursor):
+    cursor.execute("DROP TABLE IF EXISTS temp.entrantes")
+    cursor.execute(f"CREATE TEMP TABLE entrantes (orden INTEGER PRIMARY KEY, {', '.join(COLUMNAS_CAMBIOS)})")
+
+def sincronizar_desde_bd(ruta):
+    """Combina en la base local los cambios nuevos de la base de otro puesto; devuelve las filas cambiadas."""
+    if not os.path.exists(ruta):
+        raise FileNotFoundError(f"No existe la base de datos {ruta}")
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_NAME, uri=True)
+        cursor = conn.cursor()
+        uri_remota = pathlib.Path(ruta).resolve().as_uri() + "?mode=ro"
+        cursor.execute("ATTACH DATABASE ? AS remoto", (uri_remota,))
+        cursor.execute("PRAGMA remoto.table_info(cambios)")
+        if "uid" not in {fila[1] for fila in cursor.fetchall()}:
+            raise sqlite3.DatabaseError(
+                f"{ruta} no tiene registro de cambios con uid; abra primero el programa actualizado en ese puesto")
+        cursor.execute("SELECT valor FROM remoto.configuracion WHERE clave = 'origen'")
+        origen_remoto = cursor.fetchone()[0]
+        cursor.execute("SELECT valor FROM main.configuracion WHERE clave = 'origen'")
+        if cursor.fetchone()[0] == origen_remoto:
+            raise sqlite3.DatabaseError(f"{ruta} es una copia de esta misma base")
+
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("SELECT ultimo_seq FROM sincronizacion WHERE origen_remoto = ?", (origen_remoto,))
+        fila = cursor.fetchone()
+        desde = fila[0] if fila else 0
+        _crear_tabla_entrantes(cursor)
+        columnas = ", ".join(COLUMNAS_CAMBIOS)
+        cursor.execute(f"""
+            INSERT INTO temp.entrantes ({columnas})
+            SELECT {columnas} FROM remoto.cambios WHERE seq > ? ORDER BY seq
+        """, (desde,))
+        cursor.execute("SELECT MAX(seq) FROM remoto.cambios")
+        hasta = cursor.fetchone()[0] or desde
+        aplicadas = _fusionar_entrantes(cursor)
+        cursor.execute("""
+            INSERT INTO sincronizacion (origen_remoto, ultimo_seq, actualizado) VALUES (?, ?, ?)
+            ON CONFLICT (origen_remoto) DO UPDATE SET ultimo_seq = excluded.ultimo_seq,
+                                                      actualizado = excluded.actualizado
+        """, (origen_remoto, hasta, fecha_hora_actual()))
+        cursor.execute("DROP TABLE temp.entrantes")
+        conn.commit()
+        cursor.execute("DETACH DATABASE remoto")
+        return aplicadas
+    finally:
+        if conn:
+            conn.close()
+
+def sincronizar_desde_cambios(ruta, tam_lote=5000):
+    """Combina en la base local un archivo de cambios en líneas JSON; devuelve las filas cambiadas."""
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_NAME)
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        _crear_tabla_entrantes(cursor)
+        marcadores = ", ".join("?" for _ in COLUMNAS_CAMBIOS)
+        consulta = f"INSERT INTO temp.entrantes ({', '.join(COLUMNAS_CAMBIOS)}) VALUES ({marcadores})"
+        lote = []
+        with open(ruta, encoding="utf-8") as f:
+            for linea in f:
+                if not linea.strip():
+                    continue
+                cambio = json.loads(linea)
+                lote.append(tuple(cambio.get(c) for c in COLUMNAS_CAMBIOS))
+                if len(lote) >= tam_lote:
+                    cursor.executemany(consulta, lote)
+                    lote = []
+        cursor.executemany(consulta, lote)
+        aplicadas = _fusionar_entrantes(cursor)
+        cursor.execute("DROP TABLE temp.entrantes")
+        conn.commit()
+        return aplicadas
+    finally:
+        if conn:
+            conn.close()
+
+def sincronizar(ruta):
+    """Sincroniza desde una base de otro puesto (.db) o un archivo de cambios (.jsonl)."""
+    if ruta.endswith((".jsonl", ".json")):
+        aplicadas = sincronizar_desde_cambios(ruta)
+    else:
+        aplicadas = sincronizar_desde_bd(ruta)
+    if aplicadas:
+        invalidar_pedidos_pendientes()
+    return aplicadas
+
+def importar_de_otro_puesto():
+    """Opción de menú para combinar la base o el archivo de cambios de otro puesto."""
+    print("\n--- Importar ventas de otro puesto ---")
+    ruta = input("Ruta de la base (.db) o archivo de cambios (.jsonl): ").strip()
+    if not ruta:
+        print("Operación cancelada.")
+        return
+    try:
+        aplicadas = sincronizar(ruta)
+    except (sqlite3.Error, OSError, ValueError) as e:
+        print(f"Error al sincronizar: {e}")
+        return
+    print(f"Sincronización completa: {aplicadas} registros nuevos o actualizados.")
+
 def obtener_entero_positivo(mensaje):
     """Solicita un número entero positivo al usuario, con validación."""
     while True:
@@ -59,11 +1257,13 @@ def obtener_entero_positivo(mensaje):
         except ValueError:
             print("Entrada inválida. Debe ser un número entero.")
 
-def obtener_flotante_positivo(mensaje):
-    """Solicita un número decimal positivo al usuario, con validación."""
+def obtener_flotante_positivo(mensaje, por_defecto=None):
+    """Solicita un número decimal positivo al usuario, con validación y valor por defecto opcional."""
     while True:
         try:
             valor = input(mensaje).strip()
+            if not valor and por_defecto is not None:
+                return por_defecto
             if not valor:
                 print("El valor no puede estar vacío.")
                 continue
@@ -75,38 +1275,295 @@ def obtener_flotante_positivo(mensaje):
         except ValueError:
             print("Entrada inválida. Debe ser un número (puede tener decimales).")
 
-def guardar_en_bd(nombre, tipo, libras, gramos, total, cantidad_peces=None):
-    """Inserta un registro en la base de datos."""
+def fecha_hora_actual():
+    return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+def anotar_en_diario(tipo, clave=None, **datos):
+    """Agrega una operación al diario pendiente como línea JSON; devuelve True si quedó en disco."""
+    registro = {"clave": clave or uuid.uuid4().hex, "tipo": tipo, "fecha_hora": fecha_hora_actual()}
+    registro.update(datos)
+    try:
+        with open(DIARIO_PENDIENTE, "a", encoding="utf-8") as f:
+            f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        return True
+    except OSError as e:
+        print(f"Error al escribir el diario pendiente: {e}")
+        return False
+
+def insertar_venta(cursor, fecha_hora, nombre, tipo, libras, gramos, total, cantidad_peces=None, uid=None,
+                   especie=None, precio_libra=None, ticket_id=None):
+    """Inserta una fila en ventas con su uid global y origen local; devuelve su id."""
+    cursor.execute("""
+        INSERT INTO ventas (fecha_hora, nombre_cliente, cantidad_libras, cantidad_gramos, tipo, total, cantidad_peces,
+                            uid, origen, especie, precio_libra, ticket_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, (SELECT valor FROM configuracion WHERE clave = 'origen'), ?, ?, ?)
+    """, (fecha_hora, nombre, libras, gramos, tipo, total, cantidad_peces, uid or uuid.uuid4().hex,
+          especie or ESPECIE_GENERAL, precio_libra, ticket_id))
+    return cursor.lastrowid
+
+def aplicar_conversion(cursor, id_pedido, fecha_hora=None):
+    """Marca como venta un pedido con peso definido. Devuelve True si se actualizó."""
+    if fecha_hora:
+        cursor.execute("""
+            UPDATE ventas
+            SET tipo = 'venta', fecha_hora = ?
+            WHERE id = ? AND tipo = 'pedido' AND cantidad_peces IS NULL
+        """, (fecha_hora, id_pedido))
+    else:
+        cursor.execute("""
+            UPDATE ventas SET tipo = 'venta'
+            WHERE id = ? AND tipo = 'pedido' AND cantidad_peces IS NULL
+        """, (id_pedido,))
+    return cursor.rowcount == 1
+
+def aplicar_completado(cursor, id_pedido, libras, gramos, total, fecha_hora=None):
+    """Completa un pedido por peces con su peso y total. Devuelve True si se actualizó."""
+    if fecha_hora:
+        cursor.execute("""
+            UPDATE ventas
+            SET tipo = 'venta', cantidad_libras = ?, cantidad_gramos = ?, total = ?, fecha_hora = ?
+            WHERE id = ? AND tipo = 'pedido' AND cantidad_peces IS NOT NULL
+        """, (libras, gramos, total, fecha_hora, id_pedido))
+    else:
+        cursor.execute("""
+            UPDATE ventas
+            SET tipo = 'venta', cantidad_libras = ?, cantidad_gramos = ?, total = ?
+            WHERE id = ? AND tipo = 'pedido' AND cantidad_peces IS NOT NULL
+        """, (libras, gramos, total, id_pedido))
+    return cursor.rowcount == 1
+
+def guardar_en_bd(nombre, tipo, libras, gramos, total, cantidad_peces=None, especie=None, precio_libra=None,
+                 clave=None):
+    """Inserta un registro en la base de datos, o lo anota en el diario si está bloqueada."""
+    operacion = {"clave": clave or uuid.uuid4().hex, "tipo": "registro", "fecha_hora": fecha_hora_actual(),
+                 "nombre": nombre, "tipo_registro": tipo, "libras": libras, "gramos": gramos, "total": total,
+                 "cantidad_peces": cantidad_peces, "especie": especie, "precio_libra": precio_libra}
+    try:
+        resultado, repetida = ejecutar_operacion(operacion)
+    except sqlite3.OperationalError as e:
+        print(f"Base de datos no disponible ({e}).")
+        if anotar_en_diario(**operacion):
+            print("El registro quedó en el diario pendiente y se aplicará más tarde.")
+        return None
+    except (sqlite3.Error, ValueError) as e:
+        print(f"Error al guardar en la base de datos: {e}")
+        return None
+    if repetida:
+        print("Esta operación ya se había registrado; no se repitió.")
+        return resultado["venta_id"] if resultado else None
+    if tipo == "pedido":
+        indexar_pedido((resultado["venta_id"], operacion["fecha_hora"], nombre, libras, gramos, total,
+                        cantidad_peces, especie))
+    print("Registro guardado correctamente.")
+    return resultado["venta_id"]
+
+def aplicar_operacion(cursor, operacion):
+    """Aplica una sola vez una operación identificada por su clave; devuelve (resultado, repetida)."""
+    clave, tipo = operacion["clave"], operacion["tipo"]
+    if tipo not in ("registro", "ticket", "conversion", "completado"):
+        raise ValueError(f"Tipo de operación desconocido: {tipo}")
+    cursor.execute("""
+        INSERT INTO operaciones (clave, tipo, fecha_hora) VALUES (?, ?, ?)
+        ON CONFLICT (clave) DO NOTHING
+    """, (clave, tipo, operacion["fecha_hora"]))
+    if cursor.rowcount == 0:
+        cursor.execute("SELECT tipo, resultado FROM operaciones WHERE clave = ?", (clave,))
+        tipo_original, resultado = cursor.fetchone()
+        if tipo_original != tipo:
+            raise ValueError(f"La clave {clave} ya se usó para una operación de tipo {tipo_original}.")
+        # Las aplicadas desde el diario antes de guardar resultados no tienen uno
+        return (json.loads(resultado) if resultado else None), True
+
+    if tipo == "registro":
+        venta_id = insertar_venta(cursor, operacion["fecha_hora"], operacion["nombre"], operacion["tipo_registro"],
+                                  operacion["libras"], operacion["gramos"], operacion["total"],
+                                  operacion.get("cantidad_peces"), uid=clave, especie=operacion.get("especie"),
+                                  precio_libra=operacion.get("precio_libra"))
+        resultado = {"venta_id": venta_id}
+    elif tipo == "ticket":
+        ticket_id, ids = insertar_ticket(cursor, operacion["fecha_hora"], operacion["nombre"],
+                                         operacion["tipo_registro"], operacion["lineas"], uid=clave)
+        resultado = {"ticket_id": ticket_id, "ids": ids}
+    elif tipo == "conversion":
+        resultado = {"aplicada": aplicar_conversion(cursor, operacion["id_pedido"], operacion.get("nueva_fecha"))}
+    else:
+        resultado = {"aplicada": aplicar_completado(cursor, operacion["id_pedido"], operacion["libras"],
+                                                    operacion["gramos"], operacion["total"],
+                                                    operacion.get("nueva_fecha"))}
+    cursor.execute("UPDATE operaciones SET resultado = ? WHERE clave = ?", (json.dumps(resultado), clave))
+    return resultado, False
+
+def ejecutar_operacion(operacion):
+    """Aplica una operación en su propia transacción; devuelve (resultado, repetida)."""
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_NAME, timeout=ESPERA_REGISTRO)
+        resultado = aplicar_operacion(conn.cursor(), operacion)
+        conn.commit()
+    finally:
+        if conn:
+            conn.close()
+    # La base volvió a aceptar escrituras: se aplica lo que quedó en el diario
+    programar_reproduccion_diario()
+    return resultado
+
+def aplicar_operaciones(operaciones, tam_lote=500):
+    """Aplica operaciones en lotes de una transacción y genera el resultado de cada una."""
+    lote = []
+    for operacion in operaciones:
+        lote.append(operacion)
+        if len(lote) == tam_lote:
+            yield from _aplicar_lote_operaciones(lote)
+            lote = []
+    if lote:
+        yield from _aplicar_lote_operaciones(lote)
+
+def _aplicar_lote_operaciones(lote):
+    salidas = []
+    aplicadas = False
     conn = None
     try:
         conn = sqlite3.connect(DB_NAME)
         cursor = conn.cursor()
-        fecha_hora = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        cursor.execute("""
-            INSERT INTO ventas (fecha_hora, nombre_cliente, cantidad_libras, cantidad_gramos, tipo, total, cantidad_peces)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (fecha_hora, nombre, libras, gramos, tipo, total, cantidad_peces))
+        cursor.execute("BEGIN IMMEDIATE")
+        for operacion in lote:
+            clave = operacion.get("clave") if isinstance(operacion, dict) else None
+            if not clave:
+                salidas.append({"clave": None, "error": "La operación no tiene clave."})
+                continue
+            operacion.setdefault("fecha_hora", fecha_hora_actual())
+            cursor.execute("SAVEPOINT operacion")
+            try:
+                resultado, repetida = aplicar_operacion(cursor, operacion)
+            except (KeyError, TypeError, ValueError, sqlite3.IntegrityError) as e:
+                cursor.execute("ROLLBACK TO operacion")
+                salidas.append({"clave": clave, "error": f"{type(e).__name__}: {e}"})
+            else:
+                salidas.append({"clave": clave, "repetida": repetida, "resultado": resultado})
+                aplicadas = aplicadas or not repetida
+            cursor.execute("RELEASE operacion")
         conn.commit()
-        print("Registro guardado correctamente.")
+    finally:
+        if conn:
+            conn.close()
+    if aplicadas:
+        invalidar_pedidos_pendientes()
+    return salidas
+
+_bloqueo_diario = threading.RLock()
+_estado_diario = {"trabajo": None}
+
+def reproducir_diario(tam_lote=500):
+    """Aplica el diario pendiente en lotes; devuelve cuántas operaciones se aplicaron."""
+    if not _bloqueo_diario.acquire(blocking=False):
+        # Otro hilo ya lo está aplicando
+        return 0
+    try:
+        return _reproducir_diario(tam_lote)
+    finally:
+        _bloqueo_diario.release()
+
+def _guardar_rechazados(lineas):
+    with open(DIARIO_PENDIENTE + ".rechazados", "a", encoding="utf-8") as f:
+        f.writelines(linea if linea.endswith("\n") else linea + "\n" for linea in lineas)
+        f.flush()
+        os.fsync(f.fileno())
+    print(f"Aviso: {len(lineas)} líneas del diario quedaron en '{DIARIO_PENDIENTE}.rechazados' para revisarlas.")
+
+def _reproducir_diario(tam_lote):
+    en_curso = DIARIO_PENDIENTE + ".reproduciendo"
+    if not os.path.exists(en_curso):
+        try:
+            os.replace(DIARIO_PENDIENTE, en_curso)
+        except FileNotFoundError:
+            return 0
+
+    registros = []
+    rechazadas = []
+    with open(en_curso, encoding="utf-8") as f:
+        for linea in f:
+            if not linea.strip():
+                continue
+            try:
+                registros.append((linea, json.loads(linea)))
+            except json.JSONDecodeError:
+                # Línea incompleta (p. ej. un corte de luz a mitad de escritura)
+                print("Aviso: se apartó una línea dañada del diario pendiente.")
+                rechazadas.append(linea)
+
+    aplicadas = 0
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_NAME)
+        cursor = conn.cursor()
+        for inicio in range(0, len(registros), tam_lote):
+            for linea, registro in registros[inicio:inicio + tam_lote]:
+                # Una línea inválida se deshace sola y no frena el resto del diario
+                cursor.execute("SAVEPOINT registro")
+                try:
+                    resultado, repetida = aplicar_operacion(cursor, registro)
+                except (KeyError, TypeError, ValueError, sqlite3.IntegrityError) as e:
+                    cursor.execute("ROLLBACK TO registro")
+                    cursor.execute("RELEASE registro")
+                    clave = registro.get("clave") if isinstance(registro, dict) else None
+                    print(f"Aviso: se apartó la operación {clave} del diario ({type(e).__name__}: {e}).")
+                    rechazadas.append(linea)
+                    continue
+                cursor.execute("RELEASE registro")
+                if repetida:
+                    continue
+                aplicadas += 1
+                if resultado.get("aplicada") is False:
+                    print(f"Aviso: el pedido ID {registro['id_pedido']} ya no estaba pendiente; se omitió.")
+            conn.commit()
     except sqlite3.Error as e:
-        print(f"Error al guardar en la base de datos: {e}")
+        print(f"No se pudo aplicar el diario pendiente ({e}); se reintentará más tarde.")
+        invalidar_pedidos_pendientes()
+        return aplicadas
     finally:
         if conn:
             conn.close()
 
-def registrar_operacion():
-    """Flujo para registrar una venta o pedido, incluyendo la opción por peces."""
-    print("\n--- Registrar venta o pedido ---")
+    if rechazadas:
+        _guardar_rechazados(rechazadas)
+    os.remove(en_curso)
+    if aplicadas:
+        invalidar_pedidos_pendientes()
+    if os.path.exists(DIARIO_PENDIENTE):
+        # Operaciones anotadas mientras se reproducía el archivo anterior
+        aplicadas += _reproducir_diario(tam_lote)
+    return aplicadas
 
-    nombre = input("Nombre del cliente (opcional): ").strip()
-    if nombre == "":
-        nombre = None
+def _reproducir_diario_como_trabajo(progreso=None):
+    aplicadas = reproducir_diario()
+    print(f"Se aplicaron {aplicadas} operaciones pendientes del diario.")
 
-    tipo = ""
-    while tipo not in ("venta", "pedido"):
-        tipo = input("Tipo (venta/pedido): ").strip().lower()
-        if tipo not in ("venta", "pedido"):
-            print("Error: debe ser 'venta' o 'pedido'.")
+def programar_reproduccion_diario():
+    """Si quedó algo en el diario, lo aplica como trabajo en segundo plano (uno a la vez)."""
+    if not (os.path.exists(DIARIO_PENDIENTE) or os.path.exists(DIARIO_PENDIENTE + ".reproduciendo")):
+        return
+    trabajo = _estado_diario["trabajo"]
+    if trabajo is not None and trabajo["estado"] == "en curso":
+        return
+    _estado_diario["trabajo"] = lanzar_trabajo("Aplicar diario pendiente", _reproducir_diario_como_trabajo)
+
+def aplicar_diario_pendiente():
+    """Opción de menú para aplicar manualmente el diario pendiente."""
+    print("\n--- Aplicar diario pendiente ---")
+    aplicadas = reproducir_diario()
+    if aplicadas:
+        print(f"Se aplicaron {aplicadas} operaciones pendientes.")
+    elif os.path.exists(DIARIO_PENDIENTE + ".reproduciendo"):
+        print("El diario pendiente sigue sin aplicarse.")
+    else:
+        print("No hay operaciones pendientes en el diario.")
+
+def pedir_linea(tipo):
+    """Pide especie, modalidad y cantidad de una línea del ticket y la devuelve calculada."""
+    especie = elegir_especie()
+    precio = precio_vigente(especie)
 
     if tipo == "venta":
         # Solo dos modalidades para venta
@@ -115,73 +1572,154 @@ def registrar_operacion():
             modalidad = input("¿Vender por libras o por dinero? (l/d): ").strip().lower()
             if modalidad not in ("l", "d"):
                 print("Error: ingrese 'l' para libras o 'd' para dinero.")
-        if modalidad == "l":
-            libras = obtener_flotante_positivo("Cantidad en libras: ")
-            gramos = libras * 500
-            total = libras * 6000
-            print(f"\nCalculado: {libras:.2f} libras = {gramos:.2f} gramos, total ${total:,.2f}")
-            confirmar = input("¿Guardar? (s/n): ").strip().lower()
-            if confirmar == "s":
-                guardar_en_bd(nombre, tipo, libras, gramos, total)
-            else:
-                print("Operación cancelada.")
-        else:  # dinero
-            monto = obtener_flotante_positivo("Monto en COP: ")
-            libras = monto / 6000.0
-            gramos = libras * 500
-            print(f"Equivalencia aproximada: {libras:.2f} libras, {gramos:.2f} gramos")
-            total_final = obtener_flotante_positivo("Ingrese el total final a registrar (COP): ")
-            print(f"\nDatos a guardar: {libras:.2f} libras, {gramos:.2f} gramos, total ${total_final:,.2f}")
-            confirmar = input("¿Guardar? (s/n): ").strip().lower()
-            if confirmar == "s":
-                guardar_en_bd(nombre, tipo, libras, gramos, total_final)
-            else:
-                print("Operación cancelada.")
-    else:  # tipo == "pedido"
+    else:
         # Tres modalidades para pedido
         modalidad = ""
         while modalidad not in ("l", "d", "p"):
             modalidad = input("¿Registrar por libras, por dinero o por cantidad de peces? (l/d/p): ").strip().lower()
             if modalidad not in ("l", "d", "p"):
                 print("Error: ingrese 'l' para libras, 'd' para dinero o 'p' para peces.")
-        if modalidad == "l":
-            libras = obtener_flotante_positivo("Cantidad en libras: ")
-            gramos = libras * 500
-            total = libras * 6000
-            print(f"\nCalculado: {libras:.2f} libras = {gramos:.2f} gramos, total ${total:,.2f}")
-            confirmar = input("¿Guardar? (s/n): ").strip().lower()
-            if confirmar == "s":
-                guardar_en_bd(nombre, tipo, libras, gramos, total)
-            else:
-                print("Operación cancelada.")
-        elif modalidad == "d":
-            monto = obtener_flotante_positivo("Monto en COP: ")
-            libras = monto / 6000.0
-            gramos = libras * 500
-            print(f"Equivalencia aproximada: {libras:.2f} libras, {gramos:.2f} gramos")
-            total_final = obtener_flotante_positivo("Ingrese el total final a registrar (COP): ")
-            print(f"\nDatos a guardar: {libras:.2f} libras, {gramos:.2f} gramos, total ${total_final:,.2f}")
-            confirmar = input("¿Guardar? (s/n): ").strip().lower()
-            if confirmar == "s":
-                guardar_en_bd(nombre, tipo, libras, gramos, total_final)
-            else:
-                print("Operación cancelada.")
-        else:  # modalidad == "p" (por peces)
-            cantidad = obtener_entero_positivo("Cantidad de peces: ")
-            print(f"\nRegistrando pedido por {cantidad} peces. Peso y total pendientes.")
-            confirmar = input("¿Guardar? (s/n): ").strip().lower()
-            if confirmar == "s":
-                # Guardamos con libras, gramos y total en 0 (pendiente)
-                guardar_en_bd(nombre, tipo, 0.0, 0.0, 0.0, cantidad_peces=cantidad)
+
+    linea = {"especie": especie, "precio_libra": None, "cantidad_peces": None}
+    if modalidad == "l":
+        libras = obtener_flotante_positivo("Cantidad en libras: ")
+        gramos = libras * GRAMOS_POR_LIBRA
+        total = libras * precio
+        print(f"\nCalculado: {libras:.2f} libras = {gramos:.2f} gramos, total ${total:,.2f}")
+        avisar_si_falta_stock(gramos)
+        linea.update(libras=libras, gramos=gramos, total=total, precio_libra=precio)
+    elif modalidad == "d":
+        monto = obtener_flotante_positivo("Monto en COP: ")
+        libras = monto / precio
+        gramos = libras * GRAMOS_POR_LIBRA
+        print(f"Equivalencia aproximada: {libras:.2f} libras, {gramos:.2f} gramos")
+        total_final = obtener_flotante_positivo("Ingrese el total final a registrar (COP): ")
+        print(f"\nDatos a guardar: {libras:.2f} libras, {gramos:.2f} gramos, total ${total_final:,.2f}")
+        avisar_si_falta_stock(gramos)
+        linea.update(libras=libras, gramos=gramos, total=total_final)
+    else:  # modalidad == "p" (por peces)
+        cantidad = obtener_entero_positivo("Cantidad de peces: ")
+        print(f"\nRegistrando pedido por {cantidad} peces. Peso y total pendientes.")
+        avisar_si_falta_stock(peces=cantidad)
+        # Libras, gramos y total quedan en 0 (pendiente)
+        linea.update(libras=0.0, gramos=0.0, total=0.0, cantidad_peces=cantidad)
+    return linea
+
+def pedir_cliente_y_tipo():
+    nombre = input("Nombre del cliente (opcional): ").strip()
+    if nombre == "":
+        nombre = None
+
+    tipo = ""
+    while tipo not in ("venta", "pedido"):
+        tipo = input("Tipo (venta/pedido): ").strip().lower()
+        if tipo not in ("venta", "pedido"):
+            print("Error: debe ser 'venta' o 'pedido'.")
+    return nombre, tipo
+
+def registrar_operacion():
+    """Flujo para registrar una venta o pedido, incluyendo la opción por peces."""
+    print("\n--- Registrar venta o pedido ---")
+
+    nombre, tipo = pedir_cliente_y_tipo()
+    linea = pedir_linea(tipo)
+    confirmar = input("¿Guardar? (s/n): ").strip().lower()
+    if confirmar == "s":
+        guardar_en_bd(nombre, tipo, linea["libras"], linea["gramos"], linea["total"],
+                      cantidad_peces=linea["cantidad_peces"], especie=linea["especie"],
+                      precio_libra=linea["precio_libra"])
+    else:
+        print("Operación cancelada.")
+
+def guardar_ticket(nombre, tipo, lineas, clave=None):
+    """Guarda un ticket con todas sus líneas en una sola transacción; devuelve su id o None."""
+    operacion = {"clave": clave or uuid.uuid4().hex, "tipo": "ticket", "fecha_hora": fecha_hora_actual(),
+                 "nombre": nombre, "tipo_registro": tipo, "lineas": lineas}
+    try:
+        resultado, repetida = ejecutar_operacion(operacion)
+    except sqlite3.OperationalError as e:
+        print(f"Base de datos no disponible ({e}).")
+        if anotar_en_diario(**operacion):
+            print("El ticket quedó en el diario pendiente y se aplicará más tarde.")
+        return None
+    except (sqlite3.Error, ValueError) as e:
+        print(f"Error al guardar en la base de datos: {e}")
+        return None
+    if repetida:
+        print("Este ticket ya se había registrado; no se repitió.")
+        return resultado["ticket_id"] if resultado else None
+    if tipo == "pedido":
+        for venta_id, l in zip(resultado["ids"], lineas):
+            indexar_pedido((venta_id, operacion["fecha_hora"], nombre, l["libras"], l["gramos"], l["total"],
+                            l["cantidad_peces"], l["especie"]))
+    print(f"Ticket {resultado['ticket_id']} guardado con {len(lineas)} líneas.")
+    return resultado["ticket_id"]
+
+def insertar_ticket(cursor, fecha_hora, nombre, tipo, lineas, uid=None):
+    """Inserta la cabecera del ticket y sus líneas; devuelve su id y los de las líneas."""
+    uid = uid or uuid.uuid4().hex
+    cursor.execute("""
+        INSERT INTO tickets (fecha_hora, nombre_cliente, tipo, total, lineas, uid)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (fecha_hora, nombre, tipo, sum(l["total"] for l in lineas), len(lineas), uid))
+    ticket_id = cursor.lastrowid
+    ids = []
+    for n, linea in enumerate(lineas, start=1):
+        ids.append(insertar_venta(cursor, fecha_hora, nombre, tipo, linea["libras"], linea["gramos"], linea["total"],
+                                  linea["cantidad_peces"], uid=f"{uid}-{n}", especie=linea["especie"],
+                                  precio_libra=linea["precio_libra"], ticket_id=ticket_id))
+    return ticket_id, ids
+
+def registrar_carrito():
+    """Registra varias líneas para un mismo cliente y las guarda juntas como un ticket."""
+    print("\n--- Registrar carrito (varias líneas) ---")
+
+    nombre, tipo = pedir_cliente_y_tipo()
+    lineas = []
+    while True:
+        subtotal = sum(l["total"] for l in lineas)
+        print(f"\nLíneas: {len(lineas)} | Subtotal: ${subtotal:,.2f}")
+        accion = input("¿Agregar línea, quitar la última, terminar o cancelar? (a/q/t/c): ").strip().lower()
+        if accion == "a":
+            lineas.append(pedir_linea(tipo))
+        elif accion == "q":
+            if lineas:
+                lineas.pop()
+                print("Última línea quitada.")
             else:
-                print("Operación cancelada.")
+                print("El carrito está vacío.")
+        elif accion == "t":
+            if not lineas:
+                print("El carrito está vacío.")
+                continue
+            break
+        elif accion == "c":
+            print("Operación cancelada.")
+            return
+        else:
+            print("Error: ingrese 'a', 'q', 't' o 'c'.")
+
+    print("\nResumen del ticket:")
+    print("-" * 60)
+    for n, l in enumerate(lineas, start=1):
+        if l["cantidad_peces"] is not None:
+            print(f"{n}. {l['especie']}: {l['cantidad_peces']} peces (peso y total pendientes)")
+        else:
+            print(f"{n}. {l['especie']}: {l['libras']:.2f} libras, {l['gramos']:.2f} gramos, ${l['total']:,.2f}")
+    print("-" * 60)
+    print(f"Total: ${sum(l['total'] for l in lineas):,.2f}")
+    confirmar = input("¿Guardar ticket? (s/n): ").strip().lower()
+    if confirmar == "s":
+        guardar_ticket(nombre, tipo, lineas)
+    else:
+        print("Operación cancelada.")
 
 def ver_resumen():
     """Muestra los totales de ventas, pedidos y general."""
     print("\n--- Resumen ---")
     conn = None
     try:
-        conn = sqlite3.connect(DB_NAME)
+        conn = conectar_lectura()
         cursor = conn.cursor()
 
         cursor.execute("SELECT SUM(total) FROM ventas WHERE tipo='venta'")
@@ -202,22 +1740,25 @@ def ver_resumen():
         if conn:
             conn.close()
 
-def ver_historial():
-    """Muestra todos los registros ordenados por fecha descendente, incluyendo peces si existen."""
+def ver_historial(limite=None):
+    """Muestra los registros ordenados por fecha descendente, incluyendo peces si existen."""
     print("\n--- Historial de operaciones ---")
     conn = None
     try:
-        conn = sqlite3.connect(DB_NAME)
+        conn = conectar_lectura()
         cursor = conn.cursor()
         cursor.execute("""
             SELECT id, fecha_hora, nombre_cliente, cantidad_libras, cantidad_gramos, tipo, total, cantidad_peces
             FROM ventas
             ORDER BY fecha_hora DESC
-        """)
+            LIMIT ?
+        """, (-1 if limite is None else limite,))
         registros = cursor.fetchall()
         if not registros:
             print("No hay registros para mostrar.")
             return
+        if limite is not None and len(registros) == limite:
+            print(f"(Se muestran los {limite} más recientes; use la búsqueda o exporte el historial completo.)")
 
         for reg in registros:
             id_, fecha, nombre, libras, gramos, tipo, total, peces = reg
@@ -235,60 +1776,584 @@ def ver_historial():
         if conn:
             conn.close()
 
+def exportar_historial_txt(progreso=None):
+    """Escribe el historial completo en historial.txt, con el formato de ver_historial."""
+    conn = None
+    try:
+        conn = conectar_lectura()
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM ventas")
+        cantidad = cursor.fetchone()[0]
+        cursor.execute("""
+            SELECT id, fecha_hora, nombre_cliente, cantidad_libras, cantidad_gramos, tipo, total, cantidad_peces
+            FROM ventas
+            ORDER BY fecha_hora DESC
+        """)
+        with open("historial.txt", "w", encoding="utf-8") as f:
+            for n, (id_, fecha, nombre, libras, gramos, tipo, total, peces) in enumerate(cursor, start=1):
+                nombre_mostrar = nombre if nombre else "(sin nombre)"
+                f.write(f"ID: {id_} | Fecha: {fecha} | Cliente: {nombre_mostrar}\n")
+                f.write(f"   Libras: {libras:.2f} | Gramos: {gramos:.2f} | Tipo: {tipo} | Total: ${total:,.2f}")
+                f.write(f" | Peces: {peces}\n" if peces is not None else "\n")
+                f.write("-" * 50 + "\n")
+                if progreso is not None and n % 1000 == 0:
+                    progreso(n / cantidad)
+        print(f"Archivo 'historial.txt' generado correctamente ({cantidad} registros).")
+    except sqlite3.Error as e:
+        print(f"Error al consultar la base de datos: {e}")
+    except IOError as e:
+        print(f"Error al escribir el archivo: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+def respaldar_bd(progreso=None):
+    """Copia la base completa a la carpeta de respaldos con la API de respaldo de SQLite."""
+    destino = os.path.join(CARPETA_RESPALDOS,
+                           f"ventas_pescado_{datetime.datetime.now():%Y%m%d_%H%M%S}.db")
+    origen = None
+    copia = None
+    try:
+        os.makedirs(CARPETA_RESPALDOS, exist_ok=True)
+        origen = conectar_lectura()
+        copia = sqlite3.connect(destino)
+
+        def avance(estado, restantes, total):
+            if progreso is not None and total:
+                progreso(1 - restantes / total)
+        origen.backup(copia, pages=1024, progress=avance)
+        print(f"Respaldo guardado en '{destino}'.")
+    except (sqlite3.Error, OSError) as e:
+        print(f"Error al respaldar la base de datos: {e}")
+    finally:
+        if copia:
+            copia.close()
+        if origen:
+            origen.close()
+
+_pedidos_pendientes = None
+_pedidos_por_fecha = {False: [], True: []}
+_pedidos_por_palabra = []
+# Último seq de cambios visto al cargar el índice
+_version_pedidos = None
+# Los trabajos en segundo plano (p. ej. una importación) también invalidan el índice
+_bloqueo_pedidos = threading.RLock()
+
+def _normalizar(texto):
+    """Minúsculas y sin tildes, para comparar nombres de clientes."""
+    descompuesto = unicodedata.normalize("NFKD", texto or "")
+    return "".join(c for c in descompuesto if not unicodedata.combining(c)).lower()
+
+def invalidar_pedidos_pendientes():
+    """Descarta el índice en memoria; se recarga en el próximo uso."""
+    global _pedidos_pendientes
+    with _bloqueo_pedidos:
+        _pedidos_pendientes = None
+
+def cargar_pedidos_pendientes():
+    """Carga los pedidos pendientes en el índice en memoria si no está cargado o quedó viejo."""
+    global _pedidos_pendientes, _pedidos_por_fecha, _pedidos_por_palabra, _version_pedidos
+    with _bloqueo_pedidos:
+        if _pedidos_pendientes is not None:
+            return _pedidos_pendientes, _pedidos_por_fecha, _pedidos_por_palabra
+        conn = conectar_lectura()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT id, fecha_hora, nombre_cliente, cantidad_libras, cantidad_gramos, total, cantidad_peces, especie
+                FROM ventas INDEXED BY idx_ventas_pedidos
+                WHERE tipo = 'pedido'
+            """)
+            pedidos = cursor.fetchall()
+            cursor.execute("SELECT MAX(seq) FROM cambios")
+            version = cursor.fetchone()[0]
+        finally:
+            conn.close()
+        pendientes = {}
+        por_fecha = {False: [], True: []}
+        por_palabra = []
+        for pedido in pedidos:
+            pendientes[pedido[0]] = pedido
+            por_fecha[pedido[6] is not None].append((pedido[1], pedido[0]))
+            for palabra in _normalizar(pedido[2]).split():
+                por_palabra.append((palabra, pedido[0]))
+        for fechas in por_fecha.values():
+            fechas.sort()
+        por_palabra.sort()
+        _pedidos_pendientes, _pedidos_por_fecha, _pedidos_por_palabra = pendientes, por_fecha, por_palabra
+        _version_pedidos = version
+        return pendientes, por_fecha, por_palabra
+
+def refrescar_pedidos_pendientes():
+    """Descarta el índice si la base cambió desde que se cargó (p. ej. desde otra terminal)."""
+    with _bloqueo_pedidos:
+        if _pedidos_pendientes is None:
+            return
+        conn = conectar_lectura()
+        try:
+            version = conn.execute("SELECT MAX(seq) FROM cambios").fetchone()[0]
+        finally:
+            conn.close()
+        if version != _version_pedidos:
+            invalidar_pedidos_pendientes()
+
+def indexar_pedido(pedido):
+    """Agrega al índice un pedido recién guardado, si el índice está cargado y aún no lo tiene."""
+    with _bloqueo_pedidos:
+        if _pedidos_pendientes is None or pedido[0] in _pedidos_pendientes:
+            return
+        _pedidos_pendientes[pedido[0]] = pedido
+        bisect.insort(_pedidos_por_fecha[pedido[6] is not None], (pedido[1], pedido[0]))
+        for palabra in _normalizar(pedido[2]).split():
+            bisect.insort(_pedidos_por_palabra, (palabra, pedido[0]))
+
+def quitar_pedido(id_pedido):
+    """Saca del índice un pedido que dejó de estar pendiente."""
+    with _bloqueo_pedidos:
+        if _pedidos_pendientes is None or id_pedido not in _pedidos_pendientes:
+            return
+        pedido = _pedidos_pendientes.pop(id_pedido)
+        fechas = _pedidos_por_fecha[pedido[6] is not None]
+        entrada = (pedido[1], pedido[0])
+        i = bisect.bisect_left(fechas, entrada)
+        if i < len(fechas) and fechas[i] == entrada:
+            del fechas[i]
+        for palabra in _normalizar(pedido[2]).split():
+            entrada = (palabra, pedido[0])
+            i = bisect.bisect_left(_pedidos_por_palabra, entrada)
+            if i < len(_pedidos_por_palabra) and _pedidos_por_palabra[i] == entrada:
+                del _pedidos_por_palabra[i]
+
+def _es_del_tipo(pedido, por_peces):
+    return (pedido[6] is not None) == por_peces
+
+def hay_pedidos_pendientes(por_peces):
+    with _bloqueo_pedidos:
+        _, por_fecha, _ = cargar_pedidos_pendientes()
+        return bool(por_fecha[por_peces])
+
+def obtener_pedido_pendiente(id_pedido, por_peces):
+    """Devuelve el pedido pendiente de esa clase con ese id, o None."""
+    with _bloqueo_pedidos:
+        pendientes, _, _ = cargar_pedidos_pendientes()
+        pedido = pendientes.get(id_pedido)
+    return pedido if pedido and _es_del_tipo(pedido, por_peces) else None
+
+def filtrar_pedidos(texto, por_peces, limite=PEDIDOS_POR_PANTALLA):
+    """Devuelve (pedidos, hay_mas) con los pendientes cuyo cliente empieza por las palabras de texto."""
+    palabras = _normalizar(texto).split()
+    with _bloqueo_pedidos:
+        pendientes, por_fecha, por_palabra = cargar_pedidos_pendientes()
+        if not palabras:
+            fechas = por_fecha[por_peces]
+            recientes = fechas[:-limite - 1:-1]
+            return [pendientes[id_] for _, id_ in recientes], len(fechas) > limite
+
+        coincidencias = None
+        for palabra in palabras:
+            ids = set()
+            i = bisect.bisect_left(por_palabra, (palabra,))
+            while i < len(por_palabra) and por_palabra[i][0].startswith(palabra):
+                ids.add(por_palabra[i][1])
+                i += 1
+            coincidencias = ids if coincidencias is None else coincidencias & ids
+        pedidos = [pendientes[id_] for id_ in coincidencias if _es_del_tipo(pendientes[id_], por_peces)]
+    pedidos.sort(key=lambda p: p[1], reverse=True)
+    return pedidos[:limite], len(pedidos) > limite
+
+def _mostrar_pedido(pedido):
+    id_, fecha, nombre, libras, gramos, total, peces, especie = pedido
+    nombre_mostrar = nombre if nombre else "(sin nombre)"
+    if peces is None:
+        print(f"ID: {id_} | Fecha: {fecha} | Cliente: {nombre_mostrar}")
+        print(f"   Libras: {libras:.2f} | Gramos: {gramos:.2f} | Total: ${total:,.2f}")
+    else:
+        print(f"ID: {id_} | Fecha: {fecha} | Cliente: {nombre_mostrar} | Peces: {peces}")
+
+def seleccionar_pedido(por_peces, accion):
+    """Deja filtrar los pedidos pendientes por cliente y elegir uno; devuelve el pedido o None."""
+    texto = ""
+    while True:
+        pedidos, hay_mas = filtrar_pedidos(texto, por_peces)
+        if not pedidos and not texto:
+            return None
+        print("\nPedidos pendientes" + (f" que coinciden con '{texto}':" if texto else " (más recientes):"))
+        print("-" * 80)
+        for pedido in pedidos:
+            _mostrar_pedido(pedido)
+        if not pedidos:
+            print("Ningún pedido coincide.")
+        elif hay_mas:
+            print("... hay más; escriba parte del nombre del cliente para filtrar.")
+        print("-" * 80)
+
+        texto = input(f"\nID del pedido a {accion}, o nombre del cliente para filtrar (0 para cancelar): ").strip()
+        if texto == "0":
+            print("Operación cancelada.")
+            return None
+        if texto.isdigit():
+            pedido = obtener_pedido_pendiente(int(texto), por_peces)
+            if pedido:
+                return pedido
+            print(f"El ID {texto} no es un pedido pendiente de este tipo.")
+            texto = ""
+
+def buscar_ventas(texto=None, total_min=None, total_max=None, tipo=None, peces_min=None,
+                  desde=None, hasta=None, pagina=1, por_pagina=20):
+    """Busca registros por cliente, total, tipo, peces y fechas; devuelve (filas, hay_mas)."""
+    condiciones = []
+    parametros = []
+    desde_tabla = "ventas AS v"
+    orden = "v.fecha_hora DESC"
+
+    palabras = _normalizar(texto).replace('"', " ").split()
+    normalizar_en_sql = False
+    if palabras:
+        conn = conectar_lectura()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'ventas_fts'")
+            hay_fts = cursor.fetchone() is not None
+        finally:
+            conn.close()
+        if hay_fts:
+            desde_tabla = "ventas_fts JOIN ventas AS v ON v.id = ventas_fts.rowid"
+            condiciones.append("ventas_fts MATCH ?")
+            parametros.append(" ".join(f'"{p}"*' for p in palabras))
+            orden = "bm25(ventas_fts), v.fecha_hora DESC"
+        else:
+            # Sin FTS5 el nombre se normaliza igual que el texto buscado
+            normalizar_en_sql = True
+            for palabra in palabras:
+                condiciones.append("normalizar(v.nombre_cliente) LIKE ?")
+                parametros.append(f"%{palabra}%")
+    if total_min is not None:
+        condiciones.append("v.total >= ?")
+        parametros.append(total_min)
+    if total_max is not None:
+        condiciones.append("v.total <= ?")
+        parametros.append(total_max)
+    if tipo:
+        condiciones.append("v.tipo = ?")
+        parametros.append(tipo)
+    if peces_min is not None:
+        condiciones.append("v.cantidad_peces >= ?")
+        parametros.append(peces_min)
+    if desde:
+        condiciones.append("v.fecha_hora >= ?")
+        parametros.append(desde)
+    if hasta:
+        condiciones.append("v.fecha_hora < date(?, '+1 day')")
+        parametros.append(hasta)
+
+    if orden == "v.fecha_hora DESC" and not (desde or hasta) and (
+            total_min is not None or total_max is not None or peces_min is not None):
+        # Sin ventana de fechas, el rango de total o peces es el filtro selectivo:
+        # el + evita que SQLite recorra el índice de fechas o de tipo en su lugar
+        orden = "+v.fecha_hora DESC"
+        condiciones = [c.replace("v.tipo =", "+v.tipo =") for c in condiciones]
+    where = ("WHERE " + " AND ".join(condiciones)) if condiciones else ""
+    parametros += [por_pagina + 1, (pagina - 1) * por_pagina]
+    conn = conectar_lectura()
+    try:
+        if normalizar_en_sql:
+            conn.create_function("normalizar", 1, _normalizar, deterministic=True)
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT v.id, v.fecha_hora, v.nombre_cliente, v.cantidad_libras, v.cantidad_gramos, v.tipo, v.total,
+                   v.cantidad_peces
+            FROM {desde_tabla}
+            {where}
+            ORDER BY {orden}
+            LIMIT ? OFFSET ?
+        """, parametros)
+        filas = cursor.fetchall()
+    finally:
+        conn.close()
+    return filas[:por_pagina], len(filas) > por_pagina
+
+def _pedir_opcional(mensaje, convertir):
+    """Pide un valor opcional; devuelve None si se deja vacío."""
+    while True:
+        valor = input(mensaje).strip()
+        if not valor:
+            return None
+        try:
+            return convertir(valor)
+        except ValueError:
+            print("Entrada inválida.")
+
+def buscar_historial():
+    """Busca en el historial combinando cliente, total, tipo, peces y fechas, por páginas."""
+    print("\n--- Buscar en el historial ---")
+    print("Deje vacío cualquier filtro que no quiera usar.")
+    texto = input("Cliente: ").strip()
+    total_min = _pedir_opcional("Total mínimo (COP): ", float)
+    total_max = _pedir_opcional("Total máximo (COP): ", float)
+    tipo = ""
+    while tipo not in ("", "venta", "pedido"):
+        tipo = input("Tipo (venta/pedido): ").strip().lower()
+        if tipo not in ("", "venta", "pedido"):
+            print("Error: debe ser 'venta', 'pedido' o vacío.")
+    peces_min = _pedir_opcional("Peces mínimos: ", int)
+    desde = obtener_fecha("Desde (AAAA-MM-DD): ")
+    hasta = obtener_fecha("Hasta (AAAA-MM-DD): ")
+
+    pagina = 1
+    while True:
+        try:
+            filas, hay_mas = buscar_ventas(texto, total_min, total_max, tipo or None, peces_min,
+                                           desde, hasta, pagina)
+        except sqlite3.Error as e:
+            print(f"Error al consultar la base de datos: {e}")
+            return
+        if not filas and pagina == 1:
+            print("No hay registros que coincidan.")
+            return
+        print(f"\nResultados - página {pagina}")
+        print("-" * 50)
+        for id_, fecha, nombre, libras, gramos, tipo_reg, total, peces in filas:
+            nombre_mostrar = nombre if nombre else "(sin nombre)"
+            print(f"ID: {id_} | Fecha: {fecha} | Cliente: {nombre_mostrar}")
+            print(f"   Libras: {libras:.2f} | Gramos: {gramos:.2f} | Tipo: {tipo_reg} | Total: ${total:,.2f}", end="")
+            print(f" | Peces: {peces}" if peces is not None else "")
+            print("-" * 50)
+        opciones = []
+        if hay_mas:
+            opciones.append("s = siguiente")
+        if pagina > 1:
+            opciones.append("a = anterior")
+        if not opciones:
+            return
+        accion = input(f"({', '.join(opciones)}, Enter para terminar): ").strip().lower()
+        if accion == "s" and hay_mas:
+            pagina += 1
+        elif accion == "a" and pagina > 1:
+            pagina -= 1
+        else:
+            return
+
+# Reglas que se revisan fila por fila: (nombre, condición SQL, detalle SQL)
+REGLAS_INTEGRIDAD = (
+    ("gramos_libras", f"abs(cantidad_gramos - cantidad_libras * {GRAMOS_POR_LIBRA}) > 0.01",
+     f"'gramos=' || cantidad_gramos || ' pero libras*{GRAMOS_POR_LIBRA}=' || (cantidad_libras * {GRAMOS_POR_LIBRA})"),
+    ("venta_sin_total", "tipo = 'venta' AND total <= 0",
+     "'venta con total ' || total"),
+    ("peces_sin_peso", "tipo = 'venta' AND cantidad_peces IS NOT NULL AND cantidad_gramos = 0",
+     "'venta de ' || cantidad_peces || ' peces sin peso registrado'"),
+)
+
+_estado_verificacion = {"trabajo": None, "detener": None}
+
+def _leer_configuracion(cursor, clave, por_defecto=None):
+    cursor.execute("SELECT valor FROM configuracion WHERE clave = ?", (clave,))
+    fila = cursor.fetchone()
+    return fila[0] if fila else por_defecto
+
+def _guardar_configuracion(cursor, clave, valor):
+    cursor.execute("""
+        INSERT INTO configuracion (clave, valor) VALUES (?, ?)
+        ON CONFLICT (clave) DO UPDATE SET valor = excluded.valor
+    """, (clave, str(valor)))
+
+def _verificaciones_globales(cursor_lectura):
+    """Revisa la base completa y los saldos resumidos; devuelve [(regla, detalle)]."""
+    problemas = []
+    cursor_lectura.execute("PRAGMA quick_check")
+    resultado = [fila[0] for fila in cursor_lectura.fetchall()]
+    if resultado != ["ok"]:
+        problemas.append(("quick_check", "; ".join(resultado[:20])))
+
+    cursor_lectura.execute("""
+        SELECT s.gramos_disponibles, s.peces_disponibles, s.gramos_reservados, s.peces_reservados,
+               m.gramos_disponibles, m.peces_disponibles, m.gramos_reservados, m.peces_reservados
+        FROM inventario_saldo AS s,
+             (SELECT COALESCE(SUM(gramos_disponibles), 0) AS gramos_disponibles,
+                     COALESCE(SUM(peces_disponibles), 0) AS peces_disponibles,
+                     COALESCE(SUM(gramos_reservados), 0) AS gramos_reservados,
+                     COALESCE(SUM(peces_reservados), 0) AS peces_reservados
+              FROM inventario_movimientos) AS m
+        WHERE s.id = 1
+    """)
+    fila = cursor_lectura.fetchone()
+    if fila and any(abs(fila[i] - fila[i + 4]) > 0.01 for i in range(4)):
+        problemas.append(("saldo_inventario",
+                          f"saldo {fila[:4]} no coincide con la suma de movimientos {fila[4:]}"))
+
+    cursor_lectura.execute("""
+        SELECT COUNT(*) FROM reservas AS r JOIN ventas AS v ON v.id = r.venta_id
+        WHERE r.estado = 'activa' AND v.tipo <> 'pedido'
+    """)
+    huerfanas = cursor_lectura.fetchone()[0]
+    if huerfanas:
+        problemas.append(("reservas_activas", f"{huerfanas} reservas activas de registros que ya no son pedidos"))
+    return problemas
+
+def verificar_integridad(tam_lote=2000, pausa=0.05, detener=None, progreso=None):
+    """Revisa ventas por lotes de id según REGLAS_INTEGRIDAD y guarda los hallazgos nuevos."""
+    nuevos = 0
+    conn = sqlite3.connect(DB_NAME)
+    try:
+        cursor = conn.cursor()
+        ultimo_id = int(_leer_configuracion(cursor, "verificacion_ultimo_id", 0))
+        if ultimo_id == 0:
+            lectura = conectar_lectura()
+            try:
+                problemas = _verificaciones_globales(lectura.cursor())
+            finally:
+                lectura.close()
+            # Los hallazgos globales (sin venta) se reemplazan en cada pasada
+            cursor.execute("SELECT regla, detalle FROM hallazgos WHERE venta_id IS NULL")
+            anteriores = set(cursor.fetchall())
+            cursor.execute("DELETE FROM hallazgos WHERE venta_id IS NULL")
+            for regla, detalle in problemas:
+                cursor.execute("INSERT INTO hallazgos (detectado, regla, detalle) VALUES (?, ?, ?)",
+                               (fecha_hora_actual(), regla, detalle))
+                nuevos += (regla, detalle) not in anteriores
+            conn.commit()
+
+        while True:
+            if detener is not None and detener.is_set():
+                return None
+            lectura = conectar_lectura()
+            try:
+                cursor_lectura = lectura.cursor()
+                cursor_lectura.execute("SELECT MAX(id) FROM ventas")
+                maximo = cursor_lectura.fetchone()[0] or 0
+                cursor_lectura.execute("SELECT MAX(id) FROM (SELECT id FROM ventas WHERE id > ? ORDER BY id LIMIT ?)",
+                                       (ultimo_id, tam_lote))
+                hasta_id = cursor_lectura.fetchone()[0]
+                encontrados = []
+                if hasta_id is not None:
+                    for regla, condicion, detalle in REGLAS_INTEGRIDAD:
+                        cursor_lectura.execute(f"""
+                            SELECT id, {detalle} FROM ventas
+                            WHERE id > ? AND id <= ? AND {condicion}
+                        """, (ultimo_id, hasta_id))
+                        encontrados.extend((regla, id_, texto) for id_, texto in cursor_lectura.fetchall())
+            finally:
+                lectura.close()
+
+            if hasta_id is None:
+                # Pasada completa: la próxima vuelve a empezar
+                _guardar_configuracion(cursor, "verificacion_ultimo_id", 0)
+                _guardar_configuracion(cursor, "verificacion_terminada", fecha_hora_actual())
+                conn.commit()
+                return nuevos
+
+            ahora = fecha_hora_actual()
+            cursor.executemany("""
+                INSERT OR IGNORE INTO hallazgos (detectado, regla, venta_id, detalle) VALUES (?, ?, ?, ?)
+            """, [(ahora, regla, id_, texto) for regla, id_, texto in encontrados])
+            nuevos += cursor.rowcount if cursor.rowcount > 0 else 0
+            ultimo_id = hasta_id
+            _guardar_configuracion(cursor, "verificacion_ultimo_id", ultimo_id)
+            conn.commit()
+            if progreso is not None and maximo:
+                progreso(min(ultimo_id / maximo, 1.0))
+            time.sleep(pausa)
+    finally:
+        conn.close()
+
+def _bajar_prioridad_del_hilo():
+    """Baja la prioridad del hilo actual donde el sistema lo permite (Linux)."""
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+    except (AttributeError, OSError):
+        pass
+
+def _trabajo_verificacion(detener, progreso=None):
+    _bajar_prioridad_del_hilo()
+    nuevos = verificar_integridad(detener=detener, progreso=progreso)
+    if nuevos is None:
+        print("Verificación detenida; continuará donde quedó.")
+    else:
+        print(f"Verificación terminada: {nuevos} hallazgos nuevos.")
+
+def iniciar_verificacion_en_segundo_plano():
+    """Lanza verificar_integridad como trabajo de baja prioridad, si no hay uno corriendo."""
+    trabajo = _estado_verificacion["trabajo"]
+    if trabajo is not None and trabajo["estado"] == "en curso":
+        print("La verificación ya está en curso.")
+        return
+    detener = threading.Event()
+    _estado_verificacion["detener"] = detener
+    _estado_verificacion["trabajo"] = lanzar_trabajo("Verificación de integridad", _trabajo_verificacion, detener)
+
+def _describir_verificacion():
+    trabajo = _estado_verificacion["trabajo"]
+    if trabajo is None:
+        return "No se ha ejecutado en esta sesión."
+    return describir_trabajo(trabajo)
+
+def detener_verificacion():
+    trabajo = _estado_verificacion["trabajo"]
+    if trabajo is None or trabajo["estado"] != "en curso":
+        print("No hay una verificación en curso.")
+        return
+    _estado_verificacion["detener"].set()
+    print("Se pidió detener la verificación; terminará al acabar el lote actual.")
+
+def ver_hallazgos(limite=50):
+    """Muestra los hallazgos más recientes del verificador."""
+    print("\n--- Hallazgos de integridad ---")
+    print(f"Verificación: {_describir_verificacion()}")
+    conn = None
+    try:
+        conn = conectar_lectura()
+        cursor = conn.cursor()
+        cursor.execute("SELECT regla, COUNT(*) FROM hallazgos GROUP BY regla ORDER BY regla")
+        resumen = cursor.fetchall()
+        if not resumen:
+            print("No hay hallazgos registrados.")
+            return
+        for regla, cantidad in resumen:
+            print(f"{regla}: {cantidad}")
+        print("-" * 60)
+        cursor.execute("""
+            SELECT detectado, regla, venta_id, detalle FROM hallazgos ORDER BY id DESC LIMIT ?
+        """, (limite,))
+        for detectado, regla, venta_id, detalle in cursor.fetchall():
+            referencia = f"ID {venta_id}" if venta_id is not None else "base"
+            print(f"{detectado} | {regla} | {referencia} | {detalle}")
+    except sqlite3.Error as e:
+        print(f"Error al consultar la base de datos: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+def menu_integridad():
+    while True:
+        print("\n--- Integridad de los datos ---")
+        print(f"Verificación: {_describir_verificacion()}")
+        print("1. Iniciar verificación en segundo plano")
+        print("2. Detener verificación")
+        print("3. Ver hallazgos")
+        print("4. Volver")
+        opcion = input("\nSeleccione una opción (1-4): ").strip()
+        if opcion == "1":
+            iniciar_verificacion_en_segundo_plano()
+        elif opcion == "2":
+            detener_verificacion()
+        elif opcion == "3":
+            ver_hallazgos()
+        elif opcion == "4":
+            return
+        else:
+            print("Opción no válida.")
+
 def convertir_pedido_a_venta():
     """Convierte un pedido existente (con peso definido) en venta."""
     print("\n--- Convertir pedido en venta ---")
-    conn = None
     try:
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
-
-        # Solo pedidos que NO sean por peces (tienen cantidad_peces NULL)
-        cursor.execute("""
-            SELECT id, fecha_hora, nombre_cliente, cantidad_libras, cantidad_gramos, total
-            FROM ventas
-            WHERE tipo = 'pedido' AND cantidad_peces IS NULL
-            ORDER BY fecha_hora DESC
-        """)
-        pedidos = cursor.fetchall()
-
-        if not pedidos:
+        refrescar_pedidos_pendientes()
+        if not hay_pedidos_pendientes(por_peces=False):
             print("No hay pedidos pendientes (con peso definido) para convertir.")
             return
-
-        print("\nPedidos pendientes:")
-        print("-" * 80)
-        for p in pedidos:
-            id_, fecha, nombre, libras, gramos, total = p
-            nombre_mostrar = nombre if nombre else "(sin nombre)"
-            print(f"ID: {id_} | Fecha: {fecha} | Cliente: {nombre_mostrar}")
-            print(f"   Libras: {libras:.2f} | Gramos: {gramos:.2f} | Total: ${total:,.2f}")
-            print("-" * 80)
-
-        while True:
-            try:
-                id_input = input("\nIngrese el ID del pedido a convertir (0 para cancelar): ").strip()
-                if not id_input:
-                    print("Debe ingresar un valor.")
-                    continue
-                id_pedido = int(id_input)
-                if id_pedido == 0:
-                    print("Operación cancelada.")
-                    return
-                break
-            except ValueError:
-                print("ID inválido. Debe ser un número entero.")
-
-        # Validar que el ID exista, sea pedido y no tenga peces
-        cursor.execute("SELECT tipo, cantidad_peces FROM ventas WHERE id = ?", (id_pedido,))
-        resultado = cursor.fetchone()
-        if not resultado:
-            print(f"No existe ningún registro con ID {id_pedido}.")
-            return
-        tipo_actual, cantidad_peces = resultado
-        if tipo_actual != 'pedido' or cantidad_peces is not None:
-            print(f"El registro con ID {id_pedido} no es un pedido convertible (solo pedidos con peso definido).")
+        pedido = seleccionar_pedido(por_peces=False, accion="convertir")
+        if pedido is None:
             return
+        id_pedido = pedido[0]
 
         print(f"\nVa a convertir el pedido ID {id_pedido} en una venta.")
         confirmar = input("¿Confirmar conversión? (s/n): ").strip().lower()
@@ -297,75 +2362,39 @@ def convertir_pedido_a_venta():
             return
 
         actualizar_fecha = input("¿Actualizar también la fecha a la actual? (s/n): ").strip().lower()
-        if actualizar_fecha == 's':
-            fecha_actual = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            cursor.execute("""
-                UPDATE ventas
-                SET tipo = 'venta', fecha_hora = ?
-                WHERE id = ?
-            """, (fecha_actual, id_pedido))
-        else:
-            cursor.execute("UPDATE ventas SET tipo = 'venta' WHERE id = ?", (id_pedido,))
-        conn.commit()
+        nueva_fecha = fecha_hora_actual() if actualizar_fecha == 's' else None
+        operacion = {"clave": uuid.uuid4().hex, "tipo": "conversion", "fecha_hora": fecha_hora_actual(),
+                     "id_pedido": id_pedido, "nueva_fecha": nueva_fecha}
+        try:
+            resultado, _ = ejecutar_operacion(operacion)
+        except sqlite3.OperationalError as e:
+            print(f"Base de datos no disponible ({e}).")
+            if anotar_en_diario(**operacion):
+                print("La conversión quedó en el diario pendiente y se aplicará más tarde.")
+                quitar_pedido(id_pedido)
+            return
+        if not resultado["aplicada"]:
+            # Otro equipo lo modificó; el índice en memoria estaba desactualizado
+            invalidar_pedidos_pendientes()
+            print(f"El pedido ID {id_pedido} ya no está pendiente.")
+            return
+        quitar_pedido(id_pedido)
         print(f"Pedido ID {id_pedido} convertido a venta exitosamente.")
     except sqlite3.Error as e:
         print(f"Error en la base de datos: {e}")
-    finally:
-        if conn:
-            conn.close()
 
 def completar_pedido_por_peces():
     """Completa un pedido registrado por cantidad de peces, actualizando peso y total."""
     print("\n--- Completar pedido por peces ---")
-    conn = None
     try:
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
-
-        # Pedidos por peces pendientes
-        cursor.execute("""
-            SELECT id, fecha_hora, nombre_cliente, cantidad_peces
-            FROM ventas
-            WHERE tipo = 'pedido' AND cantidad_peces IS NOT NULL
-            ORDER BY fecha_hora DESC
-        """)
-        pedidos = cursor.fetchall()
-        if not pedidos:
+        refrescar_pedidos_pendientes()
+        if not hay_pedidos_pendientes(por_peces=True):
             print("No hay pedidos por peces pendientes de completar.")
             return
-
-        print("\nPedidos por peces pendientes:")
-        print("-" * 60)
-        for p in pedidos:
-            id_, fecha, nombre, cantidad = p
-            nombre_mostrar = nombre if nombre else "(sin nombre)"
-            print(f"ID: {id_} | Fecha: {fecha} | Cliente: {nombre_mostrar} | Peces: {cantidad}")
-        print("-" * 60)
-
-        while True:
-            try:
-                id_input = input("\nIngrese el ID del pedido a completar (0 para cancelar): ").strip()
-                if not id_input:
-                    print("Debe ingresar un valor.")
-                    continue
-                id_pedido = int(id_input)
-                if id_pedido == 0:
-                    print("Operación cancelada.")
-                    return
-                break
-            except ValueError:
-                print("ID inválido. Debe ser un número entero.")
-
-        # Verificar que el ID corresponda a un pedido por peces
-        cursor.execute("SELECT tipo, cantidad_peces FROM ventas WHERE id = ?", (id_pedido,))
-        resultado = cursor.fetchone()
-        if not resultado:
-            print(f"No existe ningún registro con ID {id_pedido}.")
-            return
-        tipo_actual, cantidad_peces = resultado
-        if tipo_actual != 'pedido' or cantidad_peces is None:
-            print(f"El registro con ID {id_pedido} no es un pedido por peces pendiente.")
+        pedido = seleccionar_pedido(por_peces=True, accion="completar")
+        if pedido is None:
             return
+        id_pedido, especie = pedido[0], pedido[7]
 
         # Solicitar peso y total
         print("\nIngrese los datos finales del pedido:")
@@ -376,12 +2405,13 @@ def completar_pedido_por_peces():
                 print("Error: ingrese 'l' para libras o 'g' para gramos.")
         if modalidad_peso == "l":
             libras = obtener_flotante_positivo("Cantidad en libras: ")
-            gramos = libras * 500
+            gramos = libras * GRAMOS_POR_LIBRA
         else:
             gramos = obtener_flotante_positivo("Cantidad en gramos: ")
-            libras = gramos / 500.0
+            libras = gramos / GRAMOS_POR_LIBRA
 
-        total = obtener_flotante_positivo("Total pagado (COP): ")
+        sugerido = libras * precio_vigente(especie)
+        total = obtener_flotante_positivo(f"Total pagado (COP, Enter para ${sugerido:,.2f}): ", por_defecto=sugerido)
 
         print(f"\nDatos a actualizar: Libras: {libras:.2f}, Gramos: {gramos:.2f}, Total: ${total:,.2f}")
         confirmar = input("¿Confirmar actualización? (s/n): ").strip().lower()
@@ -390,26 +2420,27 @@ def completar_pedido_por_peces():
             return
 
         actualizar_fecha = input("¿Actualizar también la fecha a la actual? (s/n): ").strip().lower()
-        if actualizar_fecha == 's':
-            fecha_actual = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            cursor.execute("""
-                UPDATE ventas
-                SET tipo = 'venta', cantidad_libras = ?, cantidad_gramos = ?, total = ?, fecha_hora = ?
-                WHERE id = ?
-            """, (libras, gramos, total, fecha_actual, id_pedido))
-        else:
-            cursor.execute("""
-                UPDATE ventas
-                SET tipo = 'venta', cantidad_libras = ?, cantidad_gramos = ?, total = ?
-                WHERE id = ?
-            """, (libras, gramos, total, id_pedido))
-        conn.commit()
+        nueva_fecha = fecha_hora_actual() if actualizar_fecha == 's' else None
+        operacion = {"clave": uuid.uuid4().hex, "tipo": "completado", "fecha_hora": fecha_hora_actual(),
+                     "id_pedido": id_pedido, "libras": libras, "gramos": gramos, "total": total,
+                     "nueva_fecha": nueva_fecha}
+        try:
+            resultado, _ = ejecutar_operacion(operacion)
+        except sqlite3.OperationalError as e:
+            print(f"Base de datos no disponible ({e}).")
+            if anotar_en_diario(**operacion):
+                print("El completado quedó en el diario pendiente y se aplicará más tarde.")
+                quitar_pedido(id_pedido)
+            return
+        if not resultado["aplicada"]:
+            # Otro equipo lo modificó; el índice en memoria estaba desactualizado
+            invalidar_pedidos_pendientes()
+            print(f"El pedido ID {id_pedido} ya no está pendiente.")
+            return
+        quitar_pedido(id_pedido)
         print(f"Pedido ID {id_pedido} completado y convertido a venta exitosamente.")
     except sqlite3.Error as e:
         print(f"Error en la base de datos: {e}")
-    finally:
-        if conn:
-            conn.close()
 
 def exportar_pedidos_html():
     """Genera un archivo HTML con todos los pedidos pendientes."""
@@ -682,11 +2713,11 @@ def exportar_ventas_html():
     except IOError as e:
         print(f"Error al escribir el archivo HTML: {e}")
 
-def exportar_pedidos_html():
+def exportar_pedidos_html(progreso=None):
     """Genera un archivo HTML con todos los pedidos pendientes."""
     conn = None
     try:
-        conn = sqlite3.connect(DB_NAME)
+        conn = conectar_lectura()
         cursor = conn.cursor()
         cursor.execute("""
             SELECT id, fecha_hora, nombre_cliente, cantidad_peces, cantidad_libras, cantidad_gramos, total
@@ -769,7 +2800,9 @@ def exportar_pedidos_html():
         </thead>
         <tbody>
 """
-        for p in pedidos:
+        for n, p in enumerate(pedidos, start=1):
+            if progreso is not None and n % 500 == 0:
+                progreso(n / len(pedidos))
             id_, fecha, nombre, peces, libras, gramos, total = p
             nombre_mostrar = nombre if nombre else "(sin nombre)"
             if peces is not None:
@@ -808,11 +2841,11 @@ def exportar_pedidos_html():
         print(f"Error al escribir el archivo HTML: {e}")
 
 
-def exportar_ventas_html():
+def exportar_ventas_html(progreso=None):
     """Genera un archivo HTML con todas las ventas realizadas y total acumulado."""
     conn = None
     try:
-        conn = sqlite3.connect(DB_NAME)
+        conn = conectar_lectura()
         cursor = conn.cursor()
         cursor.execute("""
             SELECT id, fecha_hora, nombre_cliente, cantidad_peces, cantidad_libras, cantidad_gramos, total
@@ -906,7 +2939,9 @@ def exportar_ventas_html():
         </thead>
         <tbody>
 """
-        for v in ventas:
+        for n, v in enumerate(ventas, start=1):
+            if progreso is not None and n % 500 == 0:
+                progreso(n / len(ventas))
             id_, fecha, nombre, peces, libras, gramos, total = v
             nombre_mostrar = nombre if nombre else "(sin nombre)"
             peces_mostrar = peces if peces is not None else "-"
@@ -940,47 +2975,612 @@ def exportar_ventas_html():
     except IOError as e:
         print(f"Error al escribir el archivo HTML: {e}")
 
+def _series_diarias(hasta):
+    """Devuelve los días anteriores a hasta y una matriz con libras y peces por día, o None."""
+    conn = None
+    try:
+        conn = conectar_lectura()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT substr(fecha_hora, 1, 10) AS dia, SUM(cantidad_libras), SUM(COALESCE(cantidad_peces, 0))
+            FROM ventas
+            WHERE fecha_hora < ?
+            GROUP BY dia
+            ORDER BY dia
+        """, (hasta,))
+        filas = cursor.fetchall()
+    finally:
+        if conn:
+            conn.close()
+    if not filas:
+        return None
+    fechas = np.array([f[0] for f in filas], dtype="datetime64[D]")
+    dias = np.arange(fechas[0], np.datetime64(hasta, "D"))
+    series = np.zeros((len(dias), 2))
+    series[(fechas - dias[0]).astype(int)] = [(f[1], f[2]) for f in filas]
+    return dias, series
+
+def _dia_de_la_semana(dias):
+    # 1970-01-01 fue jueves; 0 es lunes
+    return (dias.astype("int64") + 3) % 7
+
+def _nivel_suavizado(desestacionalizada, abiertos, alfa):
+    """Nivel del suavizado exponencial de cada día, calculado como una convolución."""
+    largo = min(len(desestacionalizada), int(np.ceil(np.log(1e-4) / np.log(1 - alfa))))
+    nucleo = alfa * (1 - alfa) ** np.arange(largo)
+    n = len(desestacionalizada)
+    suma = np.convolve(desestacionalizada * abiertos, nucleo)[:n]
+    pesos = np.convolve(abiertos, nucleo)[:n]
+    return np.divide(suma, pesos, out=np.zeros(n), where=pesos > 0)
+
+def _pronosticar_serie(x, dia_semana, dias_semana_futuros):
+    """Pronostica una serie diaria con índices por día de la semana y suavizado exponencial."""
+    cantidad_por_dia = np.bincount(dia_semana, minlength=7)
+    media = x.mean()
+    if media == 0:
+        estacional = np.ones(7)
+    else:
+        estacional = np.bincount(dia_semana, weights=x, minlength=7) / np.maximum(cantidad_por_dia, 1) / media
+    factores = estacional[dia_semana]
+    abiertos = (factores > 0).astype(float)
+    desestacionalizada = np.divide(x, factores, out=np.zeros(len(x)), where=factores > 0)
+
+    mejor = None
+    for alfa in np.arange(0.05, 1.0, 0.05):
+        nivel = _nivel_suavizado(desestacionalizada, abiertos, alfa)
+        # El pronóstico de cada día usa el nivel del día anterior
+        ajuste = np.concatenate(([np.nan], nivel[:-1] * factores[1:]))
+        # Los días de la semana en que no se vende no cuentan como aciertos
+        errores = np.where(factores > 0, x - ajuste, np.nan)[DIAS_MINIMOS_PRONOSTICO // 2:]
+        error_cuadratico = np.nanmean(errores ** 2)
+        if mejor is None or error_cuadratico < mejor[0]:
+            mejor = (error_cuadratico, alfa, nivel, ajuste, errores)
+    _, alfa, nivel, ajuste, errores = mejor
+
+    sigma = np.nanstd(errores, ddof=1)
+    # El último día de la serie es ayer: hoy está a un paso y mañana a dos
+    horizonte = np.arange(2, len(dias_semana_futuros) + 2)
+    pronostico = nivel[-1] * estacional[dias_semana_futuros]
+    # Varianza del suavizado exponencial simple a h días
+    desviacion = sigma * np.sqrt(1 + (horizonte - 1) * alfa ** 2) * (estacional[dias_semana_futuros] > 0)
+    # Promedio de los mismos días de la semana en las últimas cuatro semanas completas
+    semanas_atras = np.ceil(horizonte / 7)[:, None] + np.arange(4)[None, :]
+    indices = (len(x) - 1 + horizonte[:, None] - 7 * semanas_atras).astype(int)
+    return {
+        "alfa": float(alfa),
+        "pronostico": pronostico,
+        "inferior": np.maximum(pronostico - 1.96 * desviacion, 0),
+        "superior": pronostico + 1.96 * desviacion,
+        "promedio_semanas": x[indices].mean(axis=1),
+        # La semana siguiente a mañana
+        "semana": (pronostico[1:].sum(), 1.96 * np.sqrt((desviacion[1:] ** 2).sum())),
+        "ajuste": ajuste,
+    }
+
+def pronosticar_demanda(hasta=None):
+    """Pronostica libras y peces para los ocho días siguientes a hasta, o None sin historia suficiente."""
+    hasta = hasta or datetime.date.today().isoformat()
+    datos = _series_diarias(hasta)
+    if datos is None or len(datos[0]) < DIAS_MINIMOS_PRONOSTICO:
+        return None
+    dias, series = datos
+    futuros = np.datetime64(hasta, "D") + np.arange(1, 9)
+    dia_semana, dia_semana_futuro = _dia_de_la_semana(dias), _dia_de_la_semana(futuros)
+    return {
+        "dias": dias,
+        "series": series,
+        "futuros": futuros,
+        "dias_semana_futuros": dia_semana_futuro,
+        "libras": _pronosticar_serie(series[:, 0], dia_semana, dia_semana_futuro),
+        "peces": _pronosticar_serie(series[:, 1], dia_semana, dia_semana_futuro),
+    }
+
+def _calcular_pronostico():
+    """Pronóstico para las pantallas: avisa y devuelve None si no se puede calcular."""
+    if np is None:
+        print("El pronóstico de demanda necesita NumPy. Instálelo con: pip install numpy")
+        return None
+    try:
+        pronostico = pronosticar_demanda()
+    except sqlite3.Error as e:
+        print(f"Error al consultar la base de datos: {e}")
+        return None
+    if pronostico is None:
+        print(f"Se necesitan al menos {DIAS_MINIMOS_PRONOSTICO} días de historia para pronosticar.")
+    return pronostico
+
+def ver_pronostico():
+    """Muestra la demanda esperada de mañana y de la próxima semana, con bandas de error."""
+    print("\n--- Pronóstico de demanda ---")
+    pronostico = _calcular_pronostico()
+    if pronostico is None:
+        return
+    print(f"Basado en {len(pronostico['dias'])} días, hasta el {pronostico['dias'][-1]}.")
+    for clave, unidad in (("libras", "lb"), ("peces", "peces")):
+        serie = pronostico[clave]
+        total, margen = serie["semana"]
+        print(f"\n{clave.capitalize()} (alfa {serie['alfa']:.2f})")
+        print(f"{'Día':<22}{'Esperado':>12}{'Banda 95%':>24}{'Prom. 4 sem.':>14}")
+        print("-" * 72)
+        for n, fecha in enumerate(pronostico["futuros"]):
+            nombre = f"{DIAS_SEMANA[pronostico['dias_semana_futuros'][n]]} {fecha}"
+            banda = f"{serie['inferior'][n]:,.1f} - {serie['superior'][n]:,.1f}"
+            print(f"{nombre:<22}{serie['pronostico'][n]:>12,.1f}{banda:>24}{serie['promedio_semanas'][n]:>14,.1f}")
+        print(f"Mañana: {serie['pronostico'][0]:,.1f} {unidad}"
+              f" ({serie['inferior'][0]:,.1f} - {serie['superior'][0]:,.1f})")
+        print(f"Semana siguiente ({pronostico['futuros'][1]} a {pronostico['futuros'][-1]}):"
+              f" {total:,.1f} {unidad} (± {margen:,.1f})")
+
+def exportar_pronostico_html(progreso=None):
+    """Genera pronostico_demanda.html con el pronóstico y los últimos 28 días reales y ajustados."""
+    pronostico = _calcular_pronostico()
+    if pronostico is None:
+        return
+    libras, peces = pronostico["libras"], pronostico["peces"]
+    html_content = """<!DOCTYPE html>
+<html lang="es">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Pronóstico de Demanda - Pescadería</title>
+    <style>
+        body {
+            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
+            margin: 20px;
+            background-color: #f5f5f5;
+        }
+        h1, h2 {
+            color: #333;
+            text-align: center;
+        }
+        table {
+            width: 100%;
+            max-width: 1200px;
+            margin: 20px auto;
+            border-collapse: collapse;
+            background-color: white;
+            box-shadow: 0 0 10px rgba(0,0,0,0.1);
+        }
+        th, td {
+            padding: 12px 15px;
+            text-align: left;
+            border-bottom: 1px solid #ddd;
+        }
+        th {
+            background-color: #2980b9;
+            color: white;
+            font-weight: 600;
+        }
+        tr:nth-child(even) {
+            background-color: #f9f9f9;
+        }
+        .total-general {
+            text-align: right;
+            margin: 20px auto;
+            max-width: 1200px;
+            font-size: 1.3em;
+            font-weight: bold;
+            color: #2c3e50;
+            background-color: #ecf0f1;
+            padding: 10px;
+            border-radius: 5px;
+        }
+    </style>
+</head>
+<body>
+    <h1>Pronóstico de Demanda</h1>
+    <h2>Mañana y la semana siguiente</h2>
+    <table>
+        <thead>
+            <tr>
+                <th>Día</th>
+                <th>Libras esperadas</th>
+                <th>Banda 95% libras</th>
+                <th>Prom. 4 sem. libras</th>
+                <th>Peces esperados</th>
+                <th>Banda 95% peces</th>
+                <th>Prom. 4 sem. peces</th>
+            </tr>
+        </thead>
+        <tbody>
+"""
+    for n, fecha in enumerate(pronostico["futuros"]):
+        html_content += f"""            <tr>
+                <td>{DIAS_SEMANA[pronostico['dias_semana_futuros'][n]]} {fecha}</td>
+                <td>{libras['pronostico'][n]:,.1f}</td>
+                <td>{libras['inferior'][n]:,.1f} - {libras['superior'][n]:,.1f}</td>
+                <td>{libras['promedio_semanas'][n]:,.1f}</td>
+                <td>{peces['pronostico'][n]:,.1f}</td>
+                <td>{peces['inferior'][n]:,.1f} - {peces['superior'][n]:,.1f}</td>
+                <td>{peces['promedio_semanas'][n]:,.1f}</td>
+            </tr>
+"""
+    if progreso is not None:
+        progreso(0.5)
+    html_content += """        </tbody>
+    </table>
+    <h2>Últimos 28 días: real frente a pronóstico a un día</h2>
+    <table>
+        <thead>
+            <tr>
+                <th>Día</th>
+                <th>Libras reales</th>
+                <th>Libras pronosticadas</th>
+                <th>Peces reales</th>
+                <th>Peces pronosticados</th>
+            </tr>
+        </thead>
+        <tbody>
+"""
+    dias_semana = _dia_de_la_semana(pronostico["dias"])
+    for n in range(len(pronostico["dias"]) - 1, len(pronostico["dias"]) - 1 - DIAS_MINIMOS_PRONOSTICO, -1):
+        real_libras, real_peces = pronostico["series"][n]
+        html_content += f"""            <tr>
+                <td>{DIAS_SEMANA[dias_semana[n]]} {pronostico['dias'][n]}</td>
+                <td>{real_libras:,.1f}</td>
+                <td>{libras['ajuste'][n]:,.1f}</td>
+                <td>{real_peces:,.0f}</td>
+                <td>{peces['ajuste'][n]:,.1f}</td>
+            </tr>
+"""
+    total_libras, margen_libras = libras["semana"]
+    total_peces, margen_peces = peces["semana"]
+    html_content += f"""        </tbody>
+    </table>
+    <div class="total-general">
+        Mañana ({pronostico['futuros'][0]}): {libras['pronostico'][0]:,.1f} libras y {peces['pronostico'][0]:,.1f} peces<br>
+        Semana siguiente ({pronostico['futuros'][1]} a {pronostico['futuros'][-1]}): {total_libras:,.1f} libras (± {margen_libras:,.1f}) y {total_peces:,.1f} peces (± {margen_peces:,.1f})
+    </div>
+</body>
+</html>"""
+
+    try:
+        with open("pronostico_demanda.html", "w", encoding="utf-8") as f:
+            f.write(html_content)
+        print("Archivo 'pronostico_demanda.html' generado correctamente.")
+    except IOError as e:
+        print(f"Error al escribir el archivo HTML: {e}")
+
+_trabajos = []
+_tareas = set()
+_bucle = None
+_salida_del_hilo = threading.local()
+
+class _SalidaPorHilo:
+    """Salida estándar que guarda aparte lo que imprimen los trabajos en segundo plano."""
+
+    def __init__(self, salida):
+        self._salida = salida
+
+    def write(self, texto):
+        bufer = getattr(_salida_del_hilo, "bufer", None)
+        return (bufer or self._salida).write(texto)
+
+    def flush(self):
+        self._salida.flush()
+
+    def __getattr__(self, nombre):
+        return getattr(self._salida, nombre)
+
+def _en_hilo(funcion, *args):
+    """Ejecuta funcion en un hilo daemon y devuelve un futuro de asyncio con su resultado."""
+    bucle = asyncio.get_running_loop()
+    futuro = bucle.create_future()
+
+    def ejecutar():
+        try:
+            resultado = funcion(*args)
+        except BaseException as e:  # se entrega al bucle, que decide qué hacer
+            bucle.call_soon_threadsafe(lambda e=e: futuro.done() or futuro.set_exception(e))
+        else:
+            bucle.call_soon_threadsafe(lambda: futuro.done() or futuro.set_result(resultado))
+
+    threading.Thread(target=ejecutar, daemon=True).start()
+    return futuro
+
+async def _ejecutar_trabajo(trabajo, funcion, args):
+    def progreso(fraccion):
+        trabajo["progreso"] = fraccion
+
+    def ejecutar():
+        _salida_del_hilo.bufer = io.StringIO()
+        try:
+            funcion(*args, progreso=progreso)
+            return _salida_del_hilo.bufer.getvalue()
+        finally:
+            _salida_del_hilo.bufer = None
+
+    try:
+        trabajo["mensaje"] = (await _en_hilo(ejecutar)).strip()
+        trabajo["estado"] = "terminado"
+    except Exception as e:  # un trabajo que falla no debe tumbar el menú
+        trabajo["mensaje"] = f"Error: {e}"
+        trabajo["estado"] = "falló"
+
+def lanzar_trabajo(nombre, funcion, *args):
+    """Ejecuta funcion como trabajo en segundo plano y devuelve el diccionario que lo describe."""
+    trabajo = {"id": len(_trabajos) + 1, "nombre": nombre, "estado": "en curso", "progreso": None,
+               "mensaje": "", "inicio": fecha_hora_actual(), "avisado": False}
+    _trabajos.append(trabajo)
+    if _bucle is None:
+        funcion(*args, progreso=None)
+        trabajo.update(estado="terminado", avisado=True)
+        return trabajo
+
+    def crear_tarea():
+        tarea = _bucle.create_task(_ejecutar_trabajo(trabajo, funcion, args))
+        _tareas.add(tarea)
+        tarea.add_done_callback(_tareas.discard)
+
+    _bucle.call_soon_threadsafe(crear_tarea)
+    print(f"Trabajo #{trabajo['id']} iniciado en segundo plano: {nombre}.")
+    return trabajo
+
+def describir_trabajo(trabajo):
+    if trabajo["estado"] == "en curso":
+        avance = f" {trabajo['progreso']:.0%}" if trabajo["progreso"] is not None else ""
+        return f"#{trabajo['id']} {trabajo['nombre']}: en curso{avance}"
+    return f"#{trabajo['id']} {trabajo['nombre']}: {trabajo['estado']}. {trabajo['mensaje']}".strip()
+
+def _trabajos_en_curso():
+    return [t for t in _trabajos if t["estado"] == "en curso"]
+
+def _mostrar_avisos_de_trabajos():
+    """Muestra una vez cada trabajo terminado y una línea con los que siguen en curso."""
+    for trabajo in _trabajos:
+        if trabajo["estado"] != "en curso" and not trabajo["avisado"]:
+            trabajo["avisado"] = True
+            print(f"\n[Aviso] {describir_trabajo(trabajo)}")
+    en_curso = _trabajos_en_curso()
+    if en_curso:
+        print("[Trabajos] " + " | ".join(describir_trabajo(t) for t in en_curso))
+
+def ver_trabajos():
+    print("\n--- Trabajos en segundo plano ---")
+    if not _trabajos:
+        print("No se han lanzado trabajos en esta sesión.")
+        return
+    for trabajo in _trabajos:
+        print(f"{trabajo['inicio']} | {describir_trabajo(trabajo)}")
+        trabajo["avisado"] = trabajo["avisado"] or trabajo["estado"] != "en curso"
+
+def _importar_en_segundo_plano():
+    print("\n--- Importar ventas de otro puesto ---")
+    ruta = input("Ruta de la base (.db) o archivo de cambios (.jsonl): ").strip()
+    if not ruta:
+        print("Operación cancelada.")
+        return
+
+    def importar(ruta, progreso=None):
+        try:
+            aplicadas = sincronizar(ruta)
+        except (sqlite3.Error, OSError, ValueError) as e:
+            print(f"Error al sincronizar: {e}")
+            return
+        print(f"Sincronización completa: {aplicadas} registros nuevos o actualizados.")
+
+    lanzar_trabajo(f"Importar {os.path.basename(ruta)}", importar, ruta)
+
+async def _menu_asincrono():
+    global _bucle
+    _bucle = asyncio.get_running_loop()
+    try:
+        while True:
+            _mostrar_avisos_de_trabajos()
+            print("\n=== SISTEMA DE VENTAS DE PESCADO ===")
+            print("1. Registrar venta o pedido")
+            print("2. Ver resumen")
+            print("3. Ver historial")
+            print("4. Exportar pedidos pendientes a HTML")
+            print("5. Exportar ventas realizadas a HTML")
+            print("6. Convertir pedido en venta")
+            print("7. Completar pedido por peces")
+            print("8. Aplicar diario pendiente")
+            print("9. Importar ventas de otro puesto")
+            print("10. Inventario")
+            print("11. Precios")
+            print("12. Registrar carrito (varias líneas)")
+            print("13. Buscar en el historial")
+            print("14. Integridad de los datos")
+            print("15. Exportar historial completo a texto")
+            print("16. Respaldar base de datos")
+            print("17. Ver trabajos en segundo plano")
+            print("18. Cierre de caja")
+            print("19. Ver pronóstico de demanda")
+            print("20. Exportar pronóstico de demanda a HTML")
+            print("21. Salir")
+
+            opcion = (await _en_hilo(input, "\nSeleccione una opción (1-21): ")).strip()
+
+            # Las opciones interactivas corren en un hilo para que el bucle siga
+            # atendiendo los trabajos en segundo plano mientras se responde.
+            # Un error inesperado en una opción no debe cerrar la caja ni los trabajos en curso.
+            try:
+                if opcion == "1":
+                    await _en_hilo(registrar_operacion)
+                elif opcion == "2":
+                    await _en_hilo(ver_resumen)
+                elif opcion == "3":
+                    await _en_hilo(ver_historial, HISTORIAL_EN_PANTALLA)
+                elif opcion == "4":
+                    lanzar_trabajo("Exportar pedidos pendientes", exportar_pedidos_html)
+                elif opcion == "5":
+                    lanzar_trabajo("Exportar ventas realizadas", exportar_ventas_html)
+                elif opcion == "6":
+                    await _en_hilo(convertir_pedido_a_venta)
+                elif opcion == "7":
+                    await _en_hilo(completar_pedido_por_peces)
+                elif opcion == "8":
+                    await _en_hilo(aplicar_diario_pendiente)
+                elif opcion == "9":
+                    await _en_hilo(_importar_en_segundo_plano)
+                elif opcion == "10":
+                    await _en_hilo(menu_inventario)
+                elif opcion == "11":
+                    await _en_hilo(menu_precios)
+                elif opcion == "12":
+                    await _en_hilo(registrar_carrito)
+                elif opcion == "13":
+                    await _en_hilo(buscar_historial)
+                elif opcion == "14":
+                    await _en_hilo(menu_integridad)
+                elif opcion == "15":
+                    lanzar_trabajo("Exportar historial", exportar_historial_txt)
+                elif opcion == "16":
+                    lanzar_trabajo("Respaldar base de datos", respaldar_bd)
+                elif opcion == "17":
+                    ver_trabajos()
+                elif opcion == "18":
+                    await _en_hilo(menu_cierres)
+                elif opcion == "19":
+                    await _en_hilo(ver_pronostico)
+                elif opcion == "20":
+                    lanzar_trabajo("Exportar pronóstico de demanda", exportar_pronostico_html)
+                elif opcion == "21":
+                    en_curso = _trabajos_en_curso()
+                    if en_curso:
+                        confirmar = (await _en_hilo(
+                            input, f"Hay {len(en_curso)} trabajos en curso que se perderán. ¿Salir igual? (s/n): ")).strip().lower()
+                        if confirmar != "s":
+                            continue
+                    print("Saliendo del sistema.")
+                    break
+                else:
+                    print("Opción no válida.")
+            except Exception as e:
+                print(f"\nError inesperado: {e}. Puede volver a intentarlo.")
+    finally:
+        _bucle = None
+
 def menu_principal():
-    while True:
+    """Menú de la caja; los trabajos largos corren en segundo plano."""
+    sys.stdout = _SalidaPorHilo(sys.stdout)
+    try:
         limpiar_pantalla()
-        print("=== SISTEMA DE VENTAS DE PESCADO ===")
-        print("1. Registrar venta o pedido")
-        print("2. Ver resumen")
-        print("3. Ver historial")
-        print("4. Exportar pedidos pendientes a HTML")
-        print("5. Exportar ventas realizadas a HTML")
-        print("6. Convertir pedido en venta")
-        print("7. Completar pedido por peces")
-        print("8. Salir")
-
-        opcion = input("\nSeleccione una opción (1-8): ").strip()
+        asyncio.run(_menu_asincrono())
+    finally:
+        sys.stdout = sys.stdout._salida
 
-        if opcion == "1":
-            registrar_operacion()
-        elif opcion == "2":
-            ver_resumen()
-        elif opcion == "3":
-            ver_historial()
-        elif opcion == "4":
-            exportar_pedidos_html()
-        elif opcion == "5":
-            exportar_ventas_html()
-        elif opcion == "6":
-            convertir_pedido_a_venta()
-        elif opcion == "7":
-            completar_pedido_por_peces()
-        elif opcion == "8":
-            print("Saliendo del sistema.")
-            break
-        else:
-            print("Opción no válida.")
+def crear_parser():
+    parser = argparse.ArgumentParser(description="Sistema de ventas de pescado. Sin comando abre el menú.")
+    subparsers = parser.add_subparsers(dest="comando")
 
-        input("\nPresione Enter para volver.")
+    p_cambios = subparsers.add_parser("cambios", help="Emite como líneas JSON los cambios posteriores a un seq")
+    p_cambios.add_argument("--desde", type=int, default=0, help="Último seq ya procesado (por defecto 0)")
+    p_cambios.add_argument("--lote", type=int, default=500, help="Cambios leídos por lote (por defecto 500)")
 
-if __name__ == "__main__":
+    p_compactar = subparsers.add_parser("compactar", help="Borra entradas de cambios ya superadas hasta un seq")
+    p_compactar.add_argument("--hasta", type=int, required=True, help="Seq máximo a compactar")
+
+    p_sincronizar = subparsers.add_parser("sincronizar", help="Combina bases (.db) o archivos de cambios (.jsonl) de otros puestos")
+    p_sincronizar.add_argument("rutas", nargs="+", help="Bases o archivos de cambios a combinar")
+
+    p_precio = subparsers.add_parser("precio", help="Registra un precio por libra para una especie")
+    p_precio.add_argument("valor", type=float, help="Precio por libra en COP")
+    p_precio.add_argument("--especie", default=ESPECIE_GENERAL, help=f"Especie (por defecto {ESPECIE_GENERAL})")
+    p_precio.add_argument("--desde", help="Vigente desde AAAA-MM-DD (por defecto ahora)")
+
+    p_recalcular = subparsers.add_parser("recalcular", help="Recalcula los totales cobrados por libra de un rango de fechas")
+    p_recalcular.add_argument("--desde", required=True, help="Fecha inicial AAAA-MM-DD")
+    p_recalcular.add_argument("--hasta", required=True, help="Fecha final AAAA-MM-DD (incluida)")
+    p_recalcular.add_argument("--especie", help="Solo esta especie")
+
+    p_verificar = subparsers.add_parser("verificar", help="Revisa la integridad de los datos y guarda los hallazgos")
+    p_verificar.add_argument("--lote", type=int, default=2000, help="Filas revisadas por lote (por defecto 2000)")
+    p_verificar.add_argument("--pausa", type=float, default=0.0, help="Segundos de pausa entre lotes (por defecto 0)")
+
+    p_operaciones = subparsers.add_parser(
+        "operaciones", help="Aplica operaciones con clave (líneas JSON) sin duplicar las ya aplicadas")
+    p_operaciones.add_argument("archivo", help="Archivo de líneas JSON, o - para la entrada estándar")
+    p_operaciones.add_argument("--lote", type=int, default=500, help="Operaciones por transacción (por defecto 500)")
+
+    p_cierre = subparsers.add_parser("cierre", help="Cierra la caja de un día y guarda sus cifras")
+    p_cierre.add_argument("--fecha", help="Día a cerrar AAAA-MM-DD (por defecto hoy)")
+    p_cierre.add_argument("--pendientes", action="store_true",
+                          help="Cierra todos los días anteriores a hoy que no tienen cierre")
+    return parser
+
+def main(argv=None):
+    args = crear_parser().parse_args(argv)
     inicializar_bd()
+
+    if args.comando == "cambios":
+        for lote in obtener_cambios(args.desde, args.lote):
+            for cambio in lote:
+                print(json.dumps(cambio, ensure_ascii=False))
+        return
+    if args.comando == "compactar":
+        try:
+            borradas = compactar_cambios(args.hasta)
+        except sqlite3.Error as e:
+            print(f"Error al compactar el registro de cambios: {e}")
+            sys.exit(1)
+        print(f"Se borraron {borradas} entradas del registro de cambios.")
+        return
+    if args.comando == "sincronizar":
+        for ruta in args.rutas:
+            try:
+                aplicadas = sincronizar(ruta)
+            except (sqlite3.Error, OSError, ValueError) as e:
+                print(f"Error al sincronizar {ruta}: {e}")
+                sys.exit(1)
+            print(f"{ruta}: {aplicadas} registros nuevos o actualizados.")
+        return
+    if args.comando == "precio":
+        try:
+            registrar_precio(args.especie.lower(), args.valor, f"{args.desde} 00:00:00" if args.desde else None)
+        except sqlite3.Error as e:
+            print(f"Error al guardar en la base de datos: {e}")
+            sys.exit(1)
+        print(f"Precio de {args.especie.lower()} registrado: ${args.valor:,.2f} por libra.")
+        return
+    if args.comando == "recalcular":
+        try:
+            cambiadas = recalcular_totales(args.desde, args.hasta, args.especie)
+        except sqlite3.Error as e:
+            print(f"Error en la base de datos: {e}")
+            sys.exit(1)
+        print(f"Se recalcularon {cambiadas} registros.")
+        return
+    if args.comando == "verificar":
+        try:
+            nuevos = verificar_integridad(args.lote, args.pausa)
+        except sqlite3.Error as e:
+            print(f"Error en la base de datos: {e}")
+            sys.exit(1)
+        print(f"Verificación terminada: {nuevos} hallazgos nuevos.")
+        return
+    if args.comando == "operaciones":
+        entrada = sys.stdin if args.archivo == "-" else open(args.archivo, encoding="utf-8")
+        try:
+            operaciones = (json.loads(linea) for linea in entrada if linea.strip())
+            for salida in aplicar_operaciones(operaciones, args.lote):
+                print(json.dumps(salida, ensure_ascii=False))
+        except json.JSONDecodeError as e:
+            print(f"Línea JSON inválida: {e}")
+            sys.exit(1)
+        except sqlite3.Error as e:
+            print(f"Error en la base de datos: {e}; el último lote no se aplicó y se puede reenviar.")
+            sys.exit(1)
+        finally:
+            if entrada is not sys.stdin:
+                entrada.close()
+        return
+    if args.comando == "cierre":
+        if args.pendientes:
+            cerrar_dias_pendientes()
+        else:
+            cerrar_caja_del_dia(args.fecha)
+        return
+
+    aplicadas = reproducir_diario()
+    if aplicadas:
+        print(f"Se aplicaron {aplicadas} operaciones pendientes del diario.")
     try:
         menu_principal()
     except KeyboardInterrupt:
         print("\n\nInterrupción detectada. Saliendo...")
-        sys.exit(0)
\ No newline at end of file
+        sys.exit(0)
+
+if __name__ == "__main__":
+    main()